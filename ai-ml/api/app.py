@@ -3,31 +3,290 @@ Flask API for Face Recognition Service
 Production-Ready, Stable Server
 """
 
-from flask import Flask, request, jsonify
+import base64
+import hmac
+import json
+import os
+from collections import deque
+
+from flask import Flask, Response, g, has_request_context, request, jsonify
 from flask_cors import CORS
 
 # Import from same directory
 from api.face_service import FaceRecognitionService
+from api.job_queue import JobQueue
+from api.memory import MemoryTracker
+from api.pipeline import build_recognition_pipeline
+from api.profiling import RequestProfiler
+from api.routing import RecognitionRouter, shard_key
+from api import similarity
 
 app = Flask(__name__)
 CORS(app)
 
-# Initialize service
+# Opt-in request profiling (only active when PROFILE_TOKEN is set)
+profiler = RequestProfiler()
+profiler.init_app(app)
+
+# Initialize service - models load in the background (or on first request
+# with PRELOAD_MODELS=0) so the server answers /health straight away
 face_service = FaceRecognitionService()
+if os.environ.get('PRELOAD_MODELS', '1') == '1':
+    face_service.preload_in_background()
+
+# Per-request peak RSS reporting (enabled with LOW_MEMORY_MODE / MEMORY_BUDGET_MB / MEMORY_REPORT)
+MemoryTracker(face_service.memory_budget).init_app(app)
+
+# Detector backend per endpoint ('mtcnn' or 'cascade'), overridable with a
+# "detector" field in the request body
+ENDPOINT_DETECTORS = {
+    'detect': os.environ.get('DETECTOR_DETECT', FaceRecognitionService.DEFAULT_DETECTOR),
+    'registration': os.environ.get('DETECTOR_REGISTRATION', FaceRecognitionService.DEFAULT_DETECTOR),
+    'attendance': os.environ.get('DETECTOR_ATTENDANCE', FaceRecognitionService.DEFAULT_DETECTOR)
+}
+
+
+def _detector_for(endpoint: str, data: dict) -> str:
+    """Detector requested by the caller, else the endpoint's configured default"""
+    requested = data.get('detector')
+    if requested in FaceRecognitionService.DETECTORS:
+        return requested
+    return ENDPOINT_DETECTORS[endpoint]
+
+
+# Staged decode -> detect -> embed -> match pipeline shared by the
+# single-image endpoints and batch jobs (PIPELINE_ENABLED=0 runs inline)
+pipeline = build_recognition_pipeline(face_service) if os.environ.get('PIPELINE_ENABLED', '1') == '1' else None
+
+# Batch items on the shared pipeline at once, so a backlog sync never puts
+# more than a few tasks ahead of interactive requests in each stage queue
+BATCH_IN_FLIGHT = max(1, int(os.environ.get('PIPELINE_BATCH_IN_FLIGHT', 2)))
+
+
+def _make_task(kind: str, data: dict) -> dict:
+    """Build a recognition task from an endpoint / job payload"""
+    if kind in ('registration', 'detect'):
+        return face_service.make_task(
+            'registration' if kind == 'registration' else 'detection', data['image'], detector=_detector_for(kind, data)
+        )
+    
+    return face_service.make_task(
+        'attendance', data.get('capturedImage'), data.get('students', {}), _detector_for('attendance', data),
+        top_k=max(0, int(data.get('topK') or 0)),
+        encoding=data.get('capturedEncoding'),
+        return_encoding=bool(data.get('returnEncoding')),
+        gallery_key=shard_key(data.get('schoolId'), data.get('classId')) if data.get('galleryVersion') else None,
+        gallery_version=str(data['galleryVersion']) if data.get('galleryVersion') else None
+    )
+
+
+def _run_task(task: dict) -> dict:
+    """
+    Run a recognition task and return its result
+    
+    Profiled requests run inline so cProfile (which only sees the calling
+    thread) captures the whole request, as do match-only tasks (precomputed
+    encoding), which would only wait behind other requests' stages.
+    """
+    if pipeline is None or 'encoding' in task or (has_request_context() and 'cprofile' in g):
+        return face_service.run_task(task)
+    return pipeline.run(task)['result']
+
+
+def _run_batch(items: list, on_progress) -> list:
+    """Batch job items; up to BATCH_IN_FLIGHT recognition items overlap on the pipeline"""
+    def submit(item):
+        if item.get('type') in ('attendance', 'registration'):
+            return pipeline.submit(_make_task(item['type'], item))
+        return None
+    
+    futures = deque()
+    submitted = 0
+    results = []
+    for index, item in enumerate(items):
+        while submitted < len(items) and submitted - index < BATCH_IN_FLIGHT:
+            futures.append(submit(items[submitted]))
+            submitted += 1
+        future = futures.popleft()
+        
+        try:
+            if future is not None:
+                results.append(future.result()['result'])
+            else:
+                results.append(job_queue.handlers[item['type']](item))
+        except Exception as e:
+            print(f"Batch item error: {e}")
+            results.append({'success': False, 'errors': [f'Internal server error: {str(e)}']})
+        on_progress(len(results))
+    
+    return results
+
+
+def _run_duplicate_scan(payload):
+    """Collect a full gallery duplicate scan into a single job result"""
+    ids, embeddings = similarity.decode_embeddings(payload['gallery'])
+    threshold, error = _parse_threshold(payload, similarity.MIN_DUPLICATE_THRESHOLD)
+    if error:
+        raise ValueError(error)
+    
+    clusters = []
+    for event in similarity.scan_duplicates(ids, embeddings, threshold, MAX_DUPLICATE_PAIRS):
+        if event['type'] == 'error':
+            raise ValueError(event['error'])
+        if event['type'] == 'cluster':
+            clusters.append(event)
+    
+    return {
+        'success': True,
+        'scanned': len(ids),
+        'threshold': threshold,
+        'clusters': clusters
+    }
+
+
+# Durable job queue for heavy requests (large images, batches)
+job_queue = JobQueue(
+    handlers={
+        'attendance': lambda payload: _run_task(_make_task('attendance', payload)),
+        'registration': lambda payload: _run_task(_make_task('registration', payload)),
+        'duplicate-scan': _run_duplicate_scan
+    },
+    batch_handler=_run_batch if pipeline is not None else None
+)
+job_queue.start(workers=int(os.environ.get('JOB_WORKERS', 1)))
+
+# Largest similarity matrix /api/verify-batch returns inline (larger requests use "pairs")
+MAX_VERIFY_MATRIX_CELLS = int(os.environ.get('MAX_VERIFY_MATRIX_CELLS', 1_000_000))
+
+# Most pairs /api/verify-batch returns in "pairs" mode (the rest are reported as truncated)
+MAX_VERIFY_PAIRS = int(os.environ.get('MAX_VERIFY_PAIRS', 100_000))
+
+# Duplicate scans stop with an error beyond this many similar pairs
+MAX_DUPLICATE_PAIRS = int(os.environ.get('MAX_DUPLICATE_PAIRS', 200_000))
+
+
+def _parse_threshold(data: dict, minimum: float = -1.0):
+    """
+    Cosine similarity threshold from a request body
+    
+    Returns:
+        (threshold, error_message) - error is empty when valid
+    """
+    try:
+        threshold = float(data.get('threshold', FaceRecognitionService.SIMILARITY_THRESHOLD))
+    except (TypeError, ValueError):
+        return None, 'Threshold must be a number'
+    
+    if not minimum <= threshold <= 1.0:
+        return None, f'Threshold must be between {minimum:g} and 1'
+    return threshold, ""
+
+
+def _parse_top_k(data: dict):
+    """
+    Number of candidates to return from a request body (0 = off)
+    
+    Returns:
+        (top_k, error_message) - error is empty when valid
+    """
+    top_k = data.get('topK') or 0
+    if isinstance(top_k, bool) or not isinstance(top_k, int) or top_k < 0:
+        return None, 'topK must be a non-negative integer'
+    return top_k, ""
+
+
+def _encoding_error(encoding) -> str:
+    """Return an error message if a captured encoding is malformed, else empty string"""
+    if (not isinstance(encoding, list) or len(encoding) != similarity.EMBEDDING_DIM
+            or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in encoding)):
+        return f'Captured encoding must have {similarity.EMBEDDING_DIM} values'
+    return ''
+
+
+def _attendance_error(data: dict) -> str:
+    """Return an error message if an attendance request / job item is malformed, else empty string"""
+    if not data.get('capturedImage') and not data.get('capturedEncoding'):
+        return 'Captured image is required'
+    
+    if data.get('capturedEncoding') is not None:
+        error = _encoding_error(data['capturedEncoding'])
+        if error:
+            return error
+    
+    version = data.get('galleryVersion')
+    if version is not None:
+        if isinstance(version, bool) or not isinstance(version, (str, int)) or version == '':
+            return 'galleryVersion must be a non-empty string'
+        if not data.get('classId'):
+            return 'galleryVersion requires classId'
+    elif not data.get('students'):
+        return 'No student data provided'
+    
+    students = data.get('students')
+    if students is not None and not isinstance(students, dict):
+        return 'Students must be a JSON object'
+    
+    _, error = _parse_top_k(data)
+    return error
+
+
+def _classes_error(data: dict) -> str:
+    """Return an error message if a multi-class routed request is malformed, else empty string"""
+    if not data.get('capturedImage'):
+        return 'Captured image is required'
+    
+    classes = data.get('classes')
+    if not isinstance(classes, dict) or not classes:
+        return 'classes must be a non-empty JSON object of {classId: students}'
+    
+    versions = data.get('galleryVersions') or {}
+    if not isinstance(versions, dict):
+        return 'galleryVersions must be a JSON object of {classId: version}'
+    
+    for class_id, version in versions.items():
+        if isinstance(version, bool) or not isinstance(version, (str, int)) or version == '':
+            return f'galleryVersions[{class_id}] must be a non-empty string'
+    
+    for class_id, students in classes.items():
+        if students is not None and not isinstance(students, dict):
+            return f'classes[{class_id}] must be a JSON object'
+        if not students and class_id not in versions:
+            return f'No student data provided for class {class_id}'
+    
+    _, error = _parse_top_k(data)
+    return error
 
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
+    """
+    Health check endpoint
+    
+    Returns 503 if loading the models failed (e.g. MODEL_OFFLINE=1 without a
+    bundle), so the platform recycles the instance instead of routing
+    traffic to it. Still loading is healthy - use /ready for that.
+    """
     return jsonify({
-        'status': 'healthy',
+        'status': 'unhealthy' if face_service.load_error else 'healthy',
         'service': 'Face Recognition API',
         'version': '2.0',
         'model': 'FaceNet (InceptionResnetV1 + MTCNN)',
         'embedding': '512-D vectors',
         'matching': 'Cosine Similarity',
-        'mode': 'STRICT - Human faces only'
-    }), 200
+        'mode': 'STRICT - Human faces only',
+        'ready': face_service.models_loaded,
+        'modelLoadSeconds': face_service.load_seconds,
+        'modelError': face_service.load_error
+    }), 503 if face_service.load_error else 200
+
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe - 200 once models are loaded, 503 before"""
+    if face_service.models_loaded:
+        return jsonify({'ready': True, 'modelLoadSeconds': face_service.load_seconds}), 200
+    
+    return jsonify({'ready': False, 'modelError': face_service.load_error}), 503
 
 
 @app.route('/api/detect', methods=['POST'])
@@ -35,9 +294,13 @@ def detect_face():
     """
     Detect and validate human face in image
     
+    Runs the decode and detect stages of the recognition pipeline, so it
+    shares the detect worker with attendance and registration requests.
+    
     Request:
         {
-            "image": "base64_string"
+            "image": "base64_string",
+            "detector": "mtcnn" | "cascade"    # optional
         }
     
     Response:
@@ -72,44 +335,25 @@ def detect_face():
         
         print(f"[INFO] Image received, length: {len(image_b64)} chars")
         
-        # Decode image
-        image = face_service.decode_base64_image(image_b64)
-        if image is None:
-            print(f"[ERROR] Failed to decode image")
-            return jsonify({
-                'success': False,
-                'faces': 0,
-                'message': 'Invalid image format',
-                'errors': ['Could not decode image - ensure proper base64 encoding']
-            }), 400
-        
-        # Detect faces
-        face_locations, error = face_service.detect_faces(image)
-        if error:
-            return jsonify({
-                'success': False,
-                'faces': 0,
-                'message': error,
-                'errors': [error]
-            }), 200  # 200 because this is expected behavior, not server error
+        # Decode and detect on the shared pipeline (stops after detection)
+        task = _make_task('detect', data)
+        result = _run_task(task)
         
-        # Validate human face
-        is_human, error = face_service.is_human_face(image, face_locations[0])
-        if not is_human:
+        decode_error = task.get('decode_error')
+        if decode_error:
+            print(f"[ERROR] Failed to decode image: {decode_error}")
             return jsonify({
                 'success': False,
                 'faces': 0,
-                'message': error,
-                'errors': [error]
-            }), 200
+                'message': decode_error,
+                'errors': [
+                    'Could not decode image - ensure proper base64 encoding'
+                    if decode_error == 'Invalid image format' else decode_error
+                ]
+            }), 400
         
-        # Success
-        return jsonify({
-            'success': True,
-            'faces': 1,
-            'message': 'Human face detected successfully',
-            'errors': []
-        }), 200
+        # No face / not a human face is expected behavior, not a server error
+        return jsonify(result), 200
         
     except Exception as e:
         print(f"Detection error: {e}")
@@ -128,7 +372,8 @@ def register_face():
     
     Request:
         {
-            "image": "base64_string"
+            "image": "base64_string",
+            "detector": "mtcnn" | "cascade"    # optional
         }
     
     Response:
@@ -158,7 +403,7 @@ def register_face():
             }), 400
         
         # Process registration
-        result = face_service.process_registration_image(image_b64)
+        result = _run_task(_make_task('registration', data))
         
         if not result['success']:
             return jsonify(result), 200  # Return validation errors with 200
@@ -189,9 +434,21 @@ def recognize_attendance():
                     "rollNumber": "..."
                 },
                 ...
-            }
+            },
+            "detector": "mtcnn" | "cascade",   # optional
+            "topK": 5,                          # optional, also return the best k candidates
+            "capturedEncoding": [512 floats],   # optional, instead of capturedImage (match only)
+            "returnEncoding": true,             # optional, include the captured encoding
+            "schoolId": "...", "classId": "...",
+            "galleryVersion": "..."             # optional, see below
         }
     
+    With galleryVersion (any string the caller changes whenever the class's
+    students or encodings change), the class gallery stays resident on this
+    node: later requests with the same version may omit "students". If it is
+    not resident (first use, evicted, or a new version), the response is 409
+    with "galleryMissing": true and the request must be resent with students.
+    
     Response:
         {
             "success": true/false,
@@ -203,7 +460,9 @@ def recognize_attendance():
                     "rollNumber": "..."
                 }
             ],
-            "errors": [...]
+            "errors": [...],
+            "candidates": [{..., "match": true/false}],    # with topK
+            "encoding": [512 floats]                        # with returnEncoding
         }
     """
     try:
@@ -216,27 +475,30 @@ def recognize_attendance():
                 'errors': ['No JSON data received']
             }), 400
         
-        captured_image = data.get('capturedImage')
-        students = data.get('students', {})
-        
-        if not captured_image:
+        error = _attendance_error(data)
+        if error:
             return jsonify({
                 'success': False,
                 'recognized': [],
-                'errors': ['Captured image is required']
+                'errors': [error]
             }), 400
         
-        if not students:
+        task = _make_task('attendance', data)
+        
+        # Without students, answer straight away if the gallery is not resident
+        # instead of decoding and embedding the image first
+        if not task['students'] and not data.get('returnEncoding') and not face_service.galleries.get(task['gallery_key'], task['gallery_version']):
             return jsonify({
                 'success': False,
                 'recognized': [],
-                'errors': ['No student data provided']
-            }), 400
+                'errors': [FaceRecognitionService.GALLERY_MISSING],
+                'galleryMissing': True
+            }), 409
         
         # Process attendance
-        result = face_service.process_attendance_image(captured_image, students)
+        result = _run_task(task)
         
-        return jsonify(result), 200
+        return jsonify(result), 409 if result.get('galleryMissing') else 200
         
     except Exception as e:
         print(f"Attendance recognition error: {e}")
@@ -306,6 +568,555 @@ def verify_face():
         }), 500
 
 
+@app.route('/api/verify-batch', methods=['POST'])
+def verify_batch():
+    """
+    Batched 1:N / N:M face verification using one normalized matrix product
+    
+    Request:
+        {
+            "probes": [[512 floats], ...] | {"id": [512 floats]} | {"packed": "base64", "dtype": "float32", "dim": 512, "ids": [...]},
+            "references": same formats as probes (students mapping also accepted),
+            "output": "pairs" (default) | "matrix",
+            "threshold": 0.6,         # optional, cosine similarity in [-1, 1] (pairs mode)
+            "packed": false           # optional, matrix mode: return base64 float32 instead of JSON lists
+        }
+    
+    Response (pairs):
+        {
+            "success": true,
+            "pairs": [{"probeId": "...", "referenceId": "...", "similarity": 0.82, "confidence": 91.0}],
+            "truncated": false        # true if more than MAX_VERIFY_PAIRS matched - raise the threshold
+        }
+    
+    Response (matrix):
+        {
+            "success": true,
+            "probeIds": [...],
+            "referenceIds": [...],
+            "similarity": [[...], ...] or "base64"
+        }
+    """
+    try:
+        data = request.get_json()
+        
+        if not data:
+            return jsonify({
+                'success': False,
+                'error': 'No JSON data received'
+            }), 400
+        
+        if not data.get('probes') or not data.get('references'):
+            return jsonify({
+                'success': False,
+                'error': 'Both probes and references are required'
+            }), 400
+        
+        try:
+            probe_ids, probes = similarity.decode_embeddings(data['probes'])
+            reference_ids, references = similarity.decode_embeddings(data['references'])
+        except (ValueError, TypeError) as e:
+            return jsonify({
+                'success': False,
+                'error': f'Invalid embeddings: {str(e)}'
+            }), 400
+        
+        if len(probes) and len(references) and probes.shape[1] != references.shape[1]:
+            return jsonify({
+                'success': False,
+                'error': f'Dimension mismatch: probes {probes.shape[1]}-D, references {references.shape[1]}-D'
+            }), 400
+        
+        output = data.get('output', 'pairs')
+        if output not in ('pairs', 'matrix'):
+            return jsonify({
+                'success': False,
+                'error': f"Unknown output: {output} (expected 'pairs' or 'matrix')"
+            }), 400
+        
+        threshold, error = _parse_threshold(data)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+        
+        if output == 'matrix':
+            cells = len(probes) * len(references)
+            if cells > MAX_VERIFY_MATRIX_CELLS:
+                return jsonify({
+                    'success': False,
+                    'error': f'Matrix too large ({cells} cells, max {MAX_VERIFY_MATRIX_CELLS}) - use output "pairs"'
+                }), 400
+            
+            matrix = similarity.similarity_matrix(probes, references)
+            
+            if data.get('packed'):
+                scores = base64.b64encode(matrix.astype('<f4').tobytes()).decode('ascii')
+            else:
+                scores = matrix.astype(float).round(4).tolist()
+            
+            return jsonify({
+                'success': True,
+                'probeIds': probe_ids,
+                'referenceIds': reference_ids,
+                'similarity': scores
+            }), 200
+        
+        pairs, truncated = similarity.thresholded_pairs(probes, references, threshold, MAX_VERIFY_PAIRS)
+        
+        return jsonify({
+            'success': True,
+            'threshold': threshold,
+            'truncated': truncated,
+            'pairs': [
+                {
+                    'probeId': probe_ids[i],
+                    'referenceId': reference_ids[j],
+                    'similarity': round(score, 4),
+                    'confidence': round(similarity.similarity_to_confidence(score), 2)
+                }
+                for i, j, score in pairs
+            ]
+        }), 200
+        
+    except Exception as e:
+        print(f"Batch verification error: {e}")
+        return jsonify({
+            'success': False,
+            'error': f'Internal server error: {str(e)}'
+        }), 500
+
+
+@app.route('/api/gallery/duplicates', methods=['POST'])
+def scan_gallery_duplicates():
+    """
+    Gallery-wide duplicate / impostor scan (blocked all-pairs cosine similarity)
+    
+    Request:
+        {
+            "gallery": {"student_id": {"encoding": [512 floats], ...}} | packed (see /api/verify-batch),
+            "threshold": 0.6      # optional, cosine similarity, at least 0.3
+        }
+    
+    Response (application/x-ndjson, one JSON object per line):
+        {"type": "cluster", "members": ["id1", "id2"], "maxSimilarity": 0.97, "pairs": [...]}
+        {"type": "progress", "scanned": 2048, "total": 20000, "pairsFound": 3}
+        {"type": "error", "error": "..."}     # more than MAX_DUPLICATE_PAIRS similar pairs
+        {"type": "done", "clusters": 1, "pairsFound": 3, "total": 20000}
+    
+    Clusters are streamed as soon as the scan has passed all their members.
+    
+    For very large galleries submit {"type": "duplicate-scan", "gallery": ...}
+    to /api/jobs instead and poll for the collected clusters.
+    """
+    try:
+        data = request.get_json()
+        
+        if not data or not data.get('gallery'):
+            return jsonify({
+                'success': False,
+                'error': 'Gallery embeddings are required'
+            }), 400
+        
+        try:
+            ids, embeddings = similarity.decode_embeddings(data['gallery'])
+        except (ValueError, TypeError) as e:
+            return jsonify({
+                'success': False,
+                'error': f'Invalid embeddings: {str(e)}'
+            }), 400
+        
+        threshold, error = _parse_threshold(data, similarity.MIN_DUPLICATE_THRESHOLD)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+        
+        print(f"[Duplicates] Scanning {len(ids)} embeddings (threshold: {threshold})")
+        
+        def generate():
+            try:
+                for event in similarity.scan_duplicates(ids, embeddings, threshold, MAX_DUPLICATE_PAIRS):
+                    yield json.dumps(event) + '\n'
+            except Exception as e:
+                print(f"Duplicate scan error: {e}")
+                yield json.dumps({'type': 'error', 'error': str(e)}) + '\n'
+        
+        return Response(generate(), mimetype='application/x-ndjson'), 200
+        
+    except Exception as e:
+        print(f"Duplicate scan error: {e}")
+        return jsonify({
+            'success': False,
+            'error': f'Internal server error: {str(e)}'
+        }), 500
+
+
+def _validate_job_item(item) -> str:
+    """Return an error message if a job item is malformed, else empty string"""
+    if not isinstance(item, dict):
+        return 'Job item must be a JSON object'
+
+    job_type = item.get('type')
+    if job_type == 'attendance':
+        error = _attendance_error(item)
+        if error:
+            return error
+    elif job_type == 'registration':
+        if not item.get('image'):
+            return 'Image field is required'
+    elif job_type == 'duplicate-scan':
+        if not item.get('gallery'):
+            return 'Gallery embeddings are required'
+        _, error = _parse_threshold(item, similarity.MIN_DUPLICATE_THRESHOLD)
+        if error:
+            return error
+    else:
+        return f"Unknown job type: {job_type} (expected 'attendance', 'registration' or 'duplicate-scan')"
+
+    return ''
+
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    Submit a long-running recognition job
+    
+    Request (single):
+        {
+            "type": "attendance" | "registration" | "duplicate-scan",
+            ...same fields as /api/recognize-attendance, /api/register-face or /api/gallery/duplicates
+        }
+    
+    Request (batch):
+        {
+            "type": "batch",
+            "items": [{"type": "attendance", ...}, {"type": "registration", ...}]
+        }
+    
+    Response (202):
+        {
+            "success": true,
+            "jobId": "...",
+            "status": "queued"
+        }
+    """
+    try:
+        data = request.get_json()
+        
+        if not data:
+            return jsonify({
+                'success': False,
+                'jobId': None,
+                'error': 'No JSON data received'
+            }), 400
+        
+        job_type = data.get('type')
+        
+        if job_type == 'batch':
+            items = data.get('items')
+            if not isinstance(items, list) or not items:
+                return jsonify({
+                    'success': False,
+                    'jobId': None,
+                    'error': 'Batch jobs require a non-empty items list'
+                }), 400
+            
+            for index, item in enumerate(items):
+                error = _validate_job_item(item)
+                if error:
+                    return jsonify({
+                        'success': False,
+                        'jobId': None,
+                        'error': f'Item {index}: {error}'
+                    }), 400
+            
+            job_id = job_queue.submit('batch', {'items': items})
+        else:
+            error = _validate_job_item(data)
+            if error:
+                return jsonify({
+                    'success': False,
+                    'jobId': None,
+                    'error': error
+                }), 400
+            
+            job_id = job_queue.submit(job_type, data)
+        
+        return jsonify({
+            'success': True,
+            'jobId': job_id,
+            'status': JobQueue.STATUS_QUEUED
+        }), 202
+        
+    except Exception as e:
+        print(f"Job submission error: {e}")
+        return jsonify({
+            'success': False,
+            'jobId': None,
+            'error': f'Internal server error: {str(e)}'
+        }), 500
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Poll (or long-poll with ?wait=<seconds>) for a job result
+    
+    wait is capped at 30 s on threaded workers (gthread) and 2 s on sync workers.
+    
+    Response:
+        {
+            "success": true,
+            "jobId": "...",
+            "type": "attendance" | "registration" | "duplicate-scan" | "batch",
+            "status": "queued" | "running" | "done" | "failed",
+            "progress": 0, "total": 1,
+            "result": {...} or null,
+            "error": "..." or null
+        }
+    """
+    try:
+        wait = request.args.get('wait', default=0, type=float)
+        
+        # A sync worker serves one request at a time, so a long-poll there
+        # would stall /health and attendance requests - keep it short
+        if not request.environ.get('wsgi.multithread'):
+            wait = min(wait, JobQueue.SYNC_MAX_WAIT_SECONDS)
+        
+        job = job_queue.wait(job_id, wait) if wait > 0 else job_queue.get(job_id)
+        
+        if job is None:
+            return jsonify({
+                'success': False,
+                'jobId': job_id,
+                'error': 'Job not found or expired'
+            }), 404
+        
+        return jsonify({'success': True, **job}), 200
+        
+    except Exception as e:
+        print(f"Job lookup error: {e}")
+        return jsonify({
+            'success': False,
+            'jobId': job_id,
+            'error': f'Internal server error: {str(e)}'
+        }), 500
+
+
+@app.route('/api/admin/profiling', methods=['GET', 'POST'])
+def admin_profiling():
+    """
+    Arm / inspect on-demand request profiling
+    
+    Headers:
+        X-Profile-Token: <PROFILE_TOKEN>
+    
+    Request (POST):
+        {
+            "requests": 5,                              # profile the next N requests
+            "path": "/api/recognize-attendance",        # optional, only this endpoint
+            "torch": true                               # optional, also run torch.profiler
+        }
+    
+    Response:
+        {
+            "success": true,
+            "enabled": true,
+            "armed": 5,
+            "traces": ["20261019-081502-recognize_attendance-ab12cd", ...]
+        }
+    """
+    if not profiler.check_token(request.headers.get('X-Profile-Token')):
+        return jsonify({
+            'success': False,
+            'error': 'Profiling disabled or invalid token'
+        }), 403
+    
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            count = data.get('requests', 1)
+            if isinstance(count, bool) or not isinstance(count, int) or count < 0:
+                return jsonify({
+                    'success': False,
+                    'error': 'requests must be a non-negative integer'
+                }), 400
+            
+            profiler.arm(
+                count,
+                path=data.get('path'),
+                with_torch=bool(data.get('torch', True))
+            )
+        
+        return jsonify({'success': True, **profiler.status()}), 200
+        
+    except Exception as e:
+        print(f"Profiling admin error: {e}")
+        return jsonify({
+            'success': False,
+            'error': f'Internal server error: {str(e)}'
+        }), 500
+
+
+# Gallery sharding across recognition nodes (only when RECOGNITION_NODES is set)
+router = RecognitionRouter.from_env(app)
+
+
+def _check_router_token() -> bool:
+    """Membership changes need X-Admin-Token matching ROUTER_ADMIN_TOKEN (unset = disabled)"""
+    token = os.environ.get('ROUTER_ADMIN_TOKEN', '')
+    supplied = request.headers.get('X-Admin-Token')
+    return bool(token) and supplied is not None and hmac.compare_digest(supplied.encode(), token.encode())
+
+
+@app.route('/api/route/recognize-attendance', methods=['POST'])
+def route_attendance():
+    """
+    Recognize attendance on the node(s) owning the class galleries
+    
+    Request (one class - forwarded whole to the owning node):
+        {
+            "schoolId": "...",
+            "classId": "...",
+            ...same fields as /api/recognize-attendance
+        }
+    
+    Request (several classes - fanned out, top-k merged):
+        {
+            "schoolId": "...",
+            "capturedImage": "base64_string",
+            "classes": {"class_id": {"student_id": {"encoding": [...], ...}}, ...},
+            "galleryVersions": {"class_id": "v42"},   # optional, see Resident galleries
+            "topK": 5    # optional
+        }
+        A class whose version is resident on its node may send null / {}
+        instead of its students. The image is decoded and embedded once;
+        the other classes are matched against that encoding.
+    
+    Response:
+        Same as /api/recognize-attendance; fanned-out requests also return
+        "candidates" (merged top-k) and "shards" (nodes queried).
+        The X-Recognition-Nodes header lists the nodes used.
+        409 with "galleryMissing": true and "missingClasses" when a node no
+        longer holds a versioned gallery - resend those classes' students.
+    """
+    if router is None:
+        return jsonify({
+            'success': False,
+            'recognized': [],
+            'errors': ['Routing disabled - set RECOGNITION_NODES']
+        }), 503
+    
+    try:
+        data = request.get_json()
+        
+        if not data:
+            return jsonify({
+                'success': False,
+                'recognized': [],
+                'errors': ['No JSON data received']
+            }), 400
+        
+        error = _classes_error(data) if 'classes' in data else _attendance_error(data)
+        if error:
+            return jsonify({
+                'success': False,
+                'recognized': [],
+                'errors': [error]
+            }), 400
+        
+        body, status, nodes = router.recognize(data)
+        
+        response = jsonify(body)
+        response.headers['X-Recognition-Nodes'] = ','.join(nodes)
+        return response, status
+        
+    except Exception as e:
+        print(f"Routed attendance error: {e}")
+        return jsonify({
+            'success': False,
+            'recognized': [],
+            'errors': [f'Internal server error: {str(e)}']
+        }), 500
+
+
+@app.route('/api/route/nodes', methods=['GET', 'POST'])
+def route_nodes():
+    """
+    Inspect / change the recognition nodes
+    
+    Membership is stored in the job queue's SQLite file, so a change made
+    through one worker is picked up by every worker before its next route.
+    "moved.galleries" only lists galleries this worker routed recently.
+    
+    Headers (POST):
+        X-Admin-Token: <ROUTER_ADMIN_TOKEN>
+    
+    Request (POST):
+        {"add": "http://node-3:8000"}    # or "local" for an in-process stand-in
+        {"remove": "http://node-1:8000"}
+    
+    Response:
+        {
+            "success": true,
+            "nodes": [...],
+            "vnodes": 64,
+            "keyspaceShare": {"http://node-1:8000": 0.34, ...},
+            "recentGalleries": 120,
+            "moved": {                                                  # POST only
+                "share": 0.25,
+                "galleries": {"school/class": {"from": "...", "to": "..."}}
+            }
+        }
+    """
+    if router is None:
+        return jsonify({
+            'success': False,
+            'error': 'Routing disabled - set RECOGNITION_NODES'
+        }), 503
+    
+    try:
+        moved = None
+        if request.method == 'POST':
+            if not _check_router_token():
+                return jsonify({
+                    'success': False,
+                    'error': 'Node changes disabled or invalid token'
+                }), 403
+            
+            data = request.get_json(silent=True) or {}
+            if data.get('add'):
+                moved = router.add_node(data['add'])
+            elif data.get('remove'):
+                moved = router.remove_node(data['remove'])
+            else:
+                return jsonify({
+                    'success': False,
+                    'error': "Expected 'add' or 'remove'"
+                }), 400
+        
+        result = {'success': True, **router.status()}
+        if moved is not None:
+            result['moved'] = moved
+        return jsonify(result), 200
+        
+    except (KeyError, ValueError) as e:
+        return jsonify({
+            'success': False,
+            'error': str(e).strip("'")
+        }), 400
+        
+    except Exception as e:
+        print(f"Router admin error: {e}")
+        return jsonify({
+            'success': False,
+            'error': f'Internal server error: {str(e)}'
+        }), 500
+
+
 if __name__ == '__main__':
     print("=" * 70)
     print("FaceNet Face Recognition API Server Starting...")
@@ -0,0 +1,130 @@
+"""
+Pluggable Face Detector Backends
+- mtcnn:   full-frame MTCNN pyramid (most accurate, most expensive on CPU)
+- cascade: OpenCV Haar cascade proposes regions, MTCNN only runs on the
+           cropped ROIs for confidence + landmarks, full-frame MTCNN fallback
+"""
+
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+# (boxes [N, 4], probs [N], landmarks [N, 5, 2]) - same contract as MTCNN.detect()
+Detections = Tuple[Optional[np.ndarray], Optional[np.ndarray], Optional[np.ndarray]]
+
+
+class MTCNNDetector:
+    """Full-frame MTCNN detection"""
+
+    name = 'mtcnn'
+
+    def __init__(self, mtcnn):
+        self.mtcnn = mtcnn
+
+    def detect(self, rgb_image: np.ndarray) -> Detections:
+        return self.mtcnn.detect(Image.fromarray(rgb_image), landmarks=True)
+
+
+class CascadeDetector:
+    """
+    OpenCV cascade pre-detection + MTCNN on small regions of interest
+
+    The cascade only proposes regions; every reported face still comes from
+    MTCNN (probability + 5 landmarks), so is_human_face() and the confidence
+    threshold behave exactly as with full-frame detection.
+    """
+
+    name = 'cascade'
+
+    CASCADE_FILE = 'haarcascade_frontalface_default.xml'
+    PROPOSAL_MAX_SIDE = 640    # Cascade runs on a downscaled copy of large frames
+    ROI_MARGIN = 0.4           # Fraction of the proposal size added on each side
+    MAX_PROPOSALS = 3          # Beyond this many candidates the full frame is cheaper
+    MIN_NEIGHBORS = 5
+
+    def __init__(self, mtcnn, min_face_size: int = 60):
+        """
+        Args:
+            mtcnn: Shared facenet_pytorch MTCNN instance
+            min_face_size: Smallest face (pixels, full resolution) to propose
+        """
+        self.mtcnn = mtcnn
+        self.fallback = MTCNNDetector(mtcnn)
+        self.min_face_size = min_face_size
+        self.cascade = cv2.CascadeClassifier(cv2.data.haarcascades + self.CASCADE_FILE)
+
+        if self.cascade.empty():
+            raise RuntimeError(f"Could not load OpenCV cascade {self.CASCADE_FILE}")
+
+    def propose(self, rgb_image: np.ndarray) -> List[Tuple[int, int, int, int]]:
+        """
+        Candidate face regions as (x1, y1, x2, y2) in full-resolution pixels,
+        expanded by ROI_MARGIN and clipped to the image, largest first
+        """
+        height, width = rgb_image.shape[:2]
+        scale = min(1.0, self.PROPOSAL_MAX_SIDE / max(height, width))
+
+        gray = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2GRAY)
+        if scale < 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        min_size = max(20, int(self.min_face_size * scale))
+        rects = self.cascade.detectMultiScale(
+            gray,
+            scaleFactor=1.1,
+            minNeighbors=self.MIN_NEIGHBORS,
+            minSize=(min_size, min_size)
+        )
+
+        regions = []
+        for (x, y, w, h) in sorted(rects, key=lambda r: -r[2] * r[3]):
+            x, y, w, h = x / scale, y / scale, w / scale, h / scale
+            margin_x, margin_y = w * self.ROI_MARGIN, h * self.ROI_MARGIN
+            regions.append((
+                max(0, int(x - margin_x)),
+                max(0, int(y - margin_y)),
+                min(width, int(x + w + margin_x)),
+                min(height, int(y + h + margin_y))
+            ))
+        return regions
+
+    @staticmethod
+    def _iou(a: np.ndarray, b: np.ndarray) -> float:
+        x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+        x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+        inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+        union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+        return inter / union if union > 0 else 0.0
+
+    def detect(self, rgb_image: np.ndarray) -> Detections:
+        regions = self.propose(rgb_image)
+
+        if not regions or len(regions) > self.MAX_PROPOSALS:
+            return self.fallback.detect(rgb_image)
+
+        boxes, probs, points = [], [], []
+        for x1, y1, x2, y2 in regions:
+            crop = Image.fromarray(rgb_image[y1:y2, x1:x2])
+            crop_boxes, crop_probs, crop_points = self.mtcnn.detect(crop, landmarks=True)
+            if crop_boxes is None:
+                continue
+
+            offset = np.array([x1, y1], dtype=np.float32)
+            for box, prob, landmark in zip(crop_boxes, crop_probs, crop_points):
+                box = box + np.tile(offset, 2)
+                # Overlapping ROIs can see the same face twice
+                if any(self._iou(box, kept) > 0.5 for kept in boxes):
+                    continue
+                boxes.append(box)
+                probs.append(prob)
+                points.append(landmark + offset)
+
+        if not boxes:
+            # Cascade proposals were all false positives (or MTCNN disagreed) -
+            # let the full pyramid decide
+            return self.fallback.detect(rgb_image)
+
+        return np.array(boxes), np.array(probs), np.array(points)
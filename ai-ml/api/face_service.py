@@ -2,16 +2,27 @@
 Face Recognition Service using FaceNet
 Handles face detection, encoding, and matching with 512-D embeddings
 Uses InceptionResnetV1 model pre-trained on VGGFace2
+
+torch / facenet_pytorch are imported when the models are first loaded,
+so importing this module (and answering /health) stays fast.
 """
 
 import cv2
 import numpy as np
 import base64
+import io
+import os
+import threading
+import time
 from typing import Tuple, List, Optional, Dict
-import torch
-from facenet_pytorch import MTCNN, InceptionResnetV1
 from PIL import Image
 
+from api.detectors import MTCNNDetector, CascadeDetector
+from api.gallery import StudentGallery, GalleryStore
+from api.memory import MemoryBudget
+from api.profiling import record_function
+from api.similarity import similarity_to_confidence
+
 
 class FaceRecognitionService:
     """
@@ -35,15 +46,102 @@ class FaceRecognitionService:
     SIMILARITY_THRESHOLD = 0.6  # Cosine similarity threshold (higher = more similar)
     MIN_FACE_SIZE = 60         # Minimum face size in pixels
     
-    def __init__(self):
-        """Initialize FaceNet models"""
+    # Attendance error when a versioned gallery was evicted (see resolve_gallery)
+    GALLERY_MISSING = 'Gallery not resident - resend the request with students'
+    
+    # Face detector backend ('mtcnn' or 'cascade'), overridable per call
+    DETECTORS = ('mtcnn', 'cascade')
+    DEFAULT_DETECTOR = os.environ.get('DETECTOR_BACKEND', 'mtcnn')
+    
+    # Processing stages, in order (see stage_* methods)
+    PIPELINE_STAGES = ('decode', 'detect', 'embed', 'match')
+    
+    # Model artifacts (see scripts/bundle_models.py)
+    # MTCNN weights ship inside the facenet_pytorch package; only the
+    # InceptionResnetV1 weights would otherwise be downloaded on first run
+    MODEL_DIR = os.environ.get('MODEL_DIR', 'models')
+    FACENET_WEIGHTS = 'facenet-vggface2.pt'
+    MODEL_OFFLINE = os.environ.get('MODEL_OFFLINE', '0') == '1'  # Never fall back to downloading
+    
+    def __init__(self, preload: bool = False):
+        """
+        Create the service; models are loaded lazily on first use
+        
+        Args:
+            preload: Load models synchronously now instead of on first use
+        """
+        self.device = None
+        self._mtcnn = None
+        self._facenet = None
+        self._detectors: Dict = {}
+        self._load_lock = threading.Lock()
+        self.models_loaded = False
+        self.load_error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        
+        # Versioned class galleries kept resident between attendance requests
+        self.galleries = GalleryStore()
+        
+        # Input size limits / low-memory mode (see api/memory.py)
+        self.memory_budget = MemoryBudget()
+        
+        if preload:
+            self.load_models()
+    
+    @property
+    def mtcnn(self):
+        self.load_models()
+        return self._mtcnn
+    
+    @property
+    def facenet(self):
+        self.load_models()
+        return self._facenet
+    
+    @property
+    def detectors(self) -> Dict:
+        self.load_models()
+        return self._detectors
+    
+    def preload_in_background(self):
+        """Start loading models on a daemon thread so the server can accept /health immediately"""
+        def _load():
+            try:
+                self.load_models()
+            except Exception as e:
+                print(f"[FaceNet] Background model load failed: {e}")
+        
+        threading.Thread(target=_load, name='model-preload', daemon=True).start()
+    
+    def load_models(self):
+        """Initialize FaceNet models (idempotent, thread-safe)"""
+        if self.models_loaded:
+            return
+        
+        with self._load_lock:
+            if self.models_loaded:
+                return
+            
+            try:
+                self._load_models()
+                self.load_error = None
+            except Exception as e:
+                self.load_error = str(e)
+                raise
+    
+    def _load_models(self):
+        started = time.perf_counter()
+        
+        import torch
+        from facenet_pytorch import MTCNN
+        
         # Set device
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         print(f"[FaceNet] Using device: {self.device}")
         
         # Initialize MTCNN for face detection
         # Keep all faces initially, we'll filter by confidence
-        self.mtcnn = MTCNN(
+        mtcnn = MTCNN(
             image_size=160,
             margin=20,
             min_face_size=self.MIN_FACE_SIZE,
@@ -55,12 +153,52 @@ class FaceRecognitionService:
         )
         
         # Initialize FaceNet model (InceptionResnetV1 pretrained on VGGFace2)
-        self.facenet = InceptionResnetV1(
+        facenet = self._load_facenet()
+        
+        # Detector backends sharing the same MTCNN weights
+        detectors = {'mtcnn': MTCNNDetector(mtcnn)}
+        try:
+            detectors['cascade'] = CascadeDetector(mtcnn, min_face_size=self.MIN_FACE_SIZE)
+        except Exception as e:
+            print(f"[FaceNet] Cascade detector unavailable, using MTCNN only: {e}")
+        
+        self._mtcnn, self._facenet, self._detectors = mtcnn, facenet, detectors
+        self.load_seconds = round(time.perf_counter() - started, 3)
+        self.models_loaded = True
+        
+        print(f"[FaceNet] Models loaded successfully in {self.load_seconds:.2f}s")
+    
+    def _load_facenet(self):
+        """
+        Load InceptionResnetV1 from MODEL_DIR, or download the VGGFace2
+        weights via facenet_pytorch when no bundle exists (unless MODEL_OFFLINE)
+        """
+        import torch
+        from facenet_pytorch import InceptionResnetV1
+        
+        weights_path = os.path.join(self.MODEL_DIR, self.FACENET_WEIGHTS)
+        
+        if os.path.exists(weights_path):
+            print(f"[FaceNet] Loading weights from {weights_path}")
+            model = InceptionResnetV1(pretrained=None, device=self.device)
+            # The bundle is a plain state dict; weights_only refuses anything that
+            # would need arbitrary unpickling
+            state_dict = torch.load(weights_path, map_location=self.device, weights_only=True)
+            # The VGGFace2 classifier head is not used for embeddings
+            state_dict = {k: v for k, v in state_dict.items() if not k.startswith('logits.')}
+            model.load_state_dict(state_dict)
+            return model.eval()
+        
+        if self.MODEL_OFFLINE:
+            raise RuntimeError(
+                f"MODEL_OFFLINE=1 but {weights_path} is missing - run scripts/bundle_models.py"
+            )
+        
+        print(f"[FaceNet] {weights_path} not found, downloading VGGFace2 weights")
+        return InceptionResnetV1(
             pretrained='vggface2',
             device=self.device
         ).eval()
-        
-        print("[FaceNet] Models loaded successfully")
     
     @staticmethod
     def decode_base64_image(base64_string: str) -> Optional[np.ndarray]:
@@ -90,12 +228,89 @@ class FaceRecognitionService:
             print(f"[FaceNet] Error decoding image: {e}")
             return None
     
-    def detect_faces(self, image: np.ndarray) -> Tuple[List[Dict], str]:
+    def decode_image(self, base64_string: str) -> Tuple[Optional[np.ndarray], str]:
+        """
+        Decode base64 image while respecting the memory budget
+        
+        Oversized uploads are rejected; large JPEGs are decoded directly at
+        reduced resolution (DCT scaling) so their full-size bitmap is never
+        held in memory. Other formats (PNG) are fully decoded before being
+        shrunk, so their full-size bitmap is budgeted too.
+        
+        With a memory budget, the returned frame holds a reservation
+        (MemoryBudget.frame_bytes) until release_frame / release() is called.
+        
+        Args:
+            base64_string: Base64 encoded image
+            
+        Returns:
+            (image or None, error_message)
+        """
+        budget = self.memory_budget
+        
+        if not budget.enabled:
+            image = self.decode_base64_image(base64_string)
+            return (image, "") if image is not None else (None, "Invalid image format")
+        
+        try:
+            # Remove data URL prefix if present
+            if 'base64,' in base64_string:
+                base64_string = base64_string.split('base64,')[1]
+            
+            error = budget.check_upload(len(base64_string) * 3 // 4)
+            if error:
+                return None, error
+            
+            image_bytes = base64.b64decode(base64_string)
+            
+            # Read dimensions (and format) from the header only
+            try:
+                header = Image.open(io.BytesIO(image_bytes))
+                width, height = header.size
+                full_decode = header.format != 'JPEG'
+            except Image.DecompressionBombError:
+                return None, "Image too large - please upload a smaller photo"
+            except Exception:
+                return None, "Invalid image format"
+            
+            reduce, resize_scale, reserved, error = budget.plan_decode(width, height, full_decode)
+            if error:
+                return None, error
+            
+            try:
+                flag = getattr(cv2, f'IMREAD_REDUCED_COLOR_{reduce}') if reduce > 1 else cv2.IMREAD_COLOR
+                image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flag)
+                del image_bytes
+                
+                if image is not None and resize_scale:
+                    image = cv2.resize(image, None, fx=resize_scale, fy=resize_scale, interpolation=cv2.INTER_AREA)
+            except Exception:
+                budget.settle(reserved, None)
+                raise
+            
+            # Keep the reservation for the frame actually produced
+            budget.settle(reserved, image)
+            
+            if image is None:
+                return None, "Invalid image format"
+            
+            if reduce > 1 or resize_scale:
+                print(f"[Memory] Downscaled {width}x{height} -> {image.shape[1]}x{image.shape[0]}")
+            
+            return image, ""
+            
+        except Exception as e:
+            print(f"[FaceNet] Error decoding image: {e}")
+            return None, "Invalid image format"
+    
+    def detect_faces(self, image: np.ndarray, detector: Optional[str] = None) -> Tuple[List[Dict], str]:
         """
         Detect faces in image using MTCNN
         
         Args:
             image: OpenCV image (BGR)
+            detector: 'mtcnn' (full frame) or 'cascade' (OpenCV proposals + MTCNN on ROI),
+                      defaults to DEFAULT_DETECTOR
             
         Returns:
             (face_data_list, error_message)
@@ -107,10 +322,12 @@ class FaceRecognitionService:
         
         # Convert BGR to RGB
         rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        pil_image = Image.fromarray(rgb_image)
         
-        # Detect faces with MTCNN
-        boxes, probs, landmarks = self.mtcnn.detect(pil_image, landmarks=True)
+        backend = self.detectors.get(detector or self.DEFAULT_DETECTOR, self.detectors['mtcnn'])
+        
+        # Detect faces (MTCNN confidence + landmarks regardless of backend)
+        with record_function(f'detect.{backend.name}'):
+            boxes, probs, landmarks = backend.detect(rgb_image)
         
         if boxes is None or len(boxes) == 0:
             return [], "No face detected - please position your face in the camera"
@@ -194,16 +411,24 @@ class FaceRecognitionService:
             List of 512 floats or None if failed
         """
         try:
-            # Convert BGR to RGB
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(rgb_image)
+            import torch
+            
+            # Crop around the already-detected face (no second detection pass)
+            # before converting to RGB / PIL, so the BGR frame stays the only
+            # full-size copy. The padding exceeds MTCNN's alignment margin
+            # (margin/2 of 160 px per side), so extract() sees the same pixels.
+            x1, y1, x2, y2 = face_data['box']
+            pad = max(x2 - x1, y2 - y1) / 4 + 2
+            height, width = image.shape[:2]
+            left, top = max(int(x1 - pad), 0), max(int(y1 - pad), 0)
+            right, bottom = min(int(x2 + pad) + 1, width), min(int(y2 + pad) + 1, height)
             
-            # Get aligned face using MTCNN (single face mode)
-            # Create a temporary MTCNN for single face extraction
-            box = face_data['box']
+            pil_image = Image.fromarray(cv2.cvtColor(image[top:bottom, left:right], cv2.COLOR_BGR2RGB))
+            box = np.array([[x1 - left, y1 - top, x2 - left, y2 - top]])
             
             # Extract and align face
-            face_tensor = self.mtcnn(pil_image)
+            with record_function('mtcnn.align'):
+                face_tensor = self.mtcnn.extract(pil_image, box, None)
             
             if face_tensor is None:
                 print("[FaceNet] Failed to extract aligned face")
@@ -217,7 +442,7 @@ class FaceRecognitionService:
             face_tensor = face_tensor.unsqueeze(0).to(self.device)
             
             # Generate embedding
-            with torch.no_grad():
+            with torch.inference_mode(), record_function('facenet.embed'):
                 embedding = self.facenet(face_tensor)
             
             # Convert to list for JSON serialization
@@ -286,12 +511,13 @@ class FaceRecognitionService:
             print(f"[FaceNet] Matching error: {e}")
             return 0.0, False
     
-    def process_registration_image(self, base64_image: str) -> Dict:
+    def process_registration_image(self, base64_image: str, detector: Optional[str] = None) -> Dict:
         """
         Process image for student registration
         
         Args:
             base64_image: Base64 encoded image
+            detector: Detector backend name (see detect_faces)
             
         Returns:
             {
@@ -300,117 +526,200 @@ class FaceRecognitionService:
                 'error': str or None
             }
         """
-        result = {
-            'success': False,
-            'encoding': None,
-            'error': None
-        }
-        
-        # Decode image
-        image = self.decode_base64_image(base64_image)
-        if image is None:
-            result['error'] = "Invalid image format"
-            return result
-        
-        # Detect faces
-        face_data_list, error = self.detect_faces(image)
-        if error:
-            result['error'] = error
-            return result
-        
-        face_data = face_data_list[0]
-        
-        # Validate human face
-        is_human, error = self.is_human_face(image, face_data)
-        if not is_human:
-            result['error'] = error
-            return result
-        
-        # Generate encoding
-        encoding = self.generate_face_encoding(image, face_data)
-        if encoding is None:
-            result['error'] = "Failed to generate face encoding"
-            return result
-        
-        result['success'] = True
-        result['encoding'] = encoding
-        
-        return result
+        return self.run_task(self.make_task('registration', base64_image, detector=detector))
     
-    def process_attendance_image(self, base64_image: str, student_encodings: Dict[str, Dict]) -> Dict:
+    def process_attendance_image(self, base64_image: str, student_encodings: Dict[str, Dict],
+                                 detector: Optional[str] = None, top_k: int = 0) -> Dict:
         """
         Process image for attendance marking
         
         Args:
             base64_image: Base64 encoded classroom image
             student_encodings: {student_id: {'encoding': [...], 'name': str, 'rollNumber': str}}
+            detector: Detector backend name (see detect_faces)
+            top_k: Also return the k best-scoring candidates (0 = off)
             
         Returns:
             {
                 'success': bool,
                 'recognized': [{'studentId': str, 'confidence': float, 'name': str, 'rollNumber': str}],
-                'errors': [str]
+                'errors': [str],
+                'candidates': [{..., 'match': bool}]    # only when top_k > 0
             }
         """
-        result = {
-            'success': False,
-            'recognized': [],  # Changed from 'matches' to match backend expectation
-            'errors': []
-        }
+        return self.run_task(self.make_task('attendance', base64_image, student_encodings, detector, top_k=top_k))
+    
+    # ------------------------------------------------------------------
+    # Pipeline stages
+    # decode -> detect (+ landmark check) -> embed -> match
+    # Each stage takes and returns a task dict, so the same code runs
+    # sequentially (run_task) or on a staged pipeline (api/pipeline.py)
+    # Detection tasks (/api/detect) finish after the detect stage
+    # ------------------------------------------------------------------
+    
+    @staticmethod
+    def make_task(kind: str, base64_image: Optional[str], student_encodings: Optional[Dict[str, Dict]] = None,
+                  detector: Optional[str] = None, top_k: int = 0, encoding: Optional[List[float]] = None,
+                  return_encoding: bool = False, gallery_key: Optional[str] = None,
+                  gallery_version: Optional[str] = None) -> Dict:
+        """
+        Create a pipeline task
+        
+        Args:
+            kind: 'registration', 'attendance' or 'detection' (decode + detect only)
+            base64_image: Base64 encoded image (None when encoding is given)
+            student_encodings: Students to match against (attendance only)
+            detector: Detector backend name (see detect_faces)
+            top_k: Attendance only - add the k best-scoring candidates to the result
+            encoding: Attendance only - precomputed face encoding; the task
+                      then runs the match stage only
+            return_encoding: Attendance only - include the captured encoding in
+                             the result (lets a router reuse it on other shards)
+            gallery_key: Attendance only - resident gallery key (schoolId/classId)
+            gallery_version: Attendance only - version of the students; with a
+                             gallery_key, a resident gallery at this version is
+                             used instead of student_encodings (see resolve_gallery)
+        """
+        if kind == 'registration':
+            result = {
+                'success': False,
+                'encoding': None,
+                'error': None
+            }
+        elif kind == 'detection':
+            result = {
+                'success': False,
+                'faces': 0,
+                'message': '',
+                'errors': []
+            }
+        else:
+            result = {
+                'success': False,
+                'recognized': [],  # Changed from 'matches' to match backend expectation
+                'errors': []
+            }
         
-        # Decode image
-        image = self.decode_base64_image(base64_image)
+        task = {
+            'kind': kind,
+            'image_b64': base64_image,
+            'students': student_encodings or {},
+            'detector': detector,
+            'top_k': top_k,
+            'return_encoding': return_encoding,
+            'gallery_key': gallery_key,
+            'gallery_version': gallery_version,
+            'result': result,
+            'done': False
+        }
+        if encoding is not None:
+            task['encoding'] = encoding
+        return task
+    
+    @staticmethod
+    def _fail(task: Dict, error: str) -> Dict:
+        """Record an error in the task's result and stop further stages"""
+        if task['kind'] == 'registration':
+            task['result']['error'] = error
+        else:
+            task['result']['errors'].append(error)
+        if task['kind'] == 'detection':
+            task['result']['message'] = error
+        task['done'] = True
+        return task
+    
+    def run_task(self, task: Dict) -> Dict:
+        """Run all stages of a task in the calling thread and return its result"""
+        # Tasks created with a precomputed encoding only need matching
+        stages = ('match',) if 'encoding' in task else self.PIPELINE_STAGES
+        try:
+            for stage in stages:
+                if task['done']:
+                    break
+                task = getattr(self, f'stage_{stage}')(task)
+        finally:
+            self.release_frame(task)
+        return task['result']
+    
+    def release_frame(self, task: Dict):
+        """Drop a task's decoded frame (if still held) and its memory reservation"""
+        image = task.pop('image', None)
+        if image is not None:
+            self.memory_budget.release(self.memory_budget.frame_bytes(image))
+    
+    def stage_decode(self, task: Dict) -> Dict:
+        # Drop the base64 string as soon as it has been decoded
+        image, error = self.decode_image(task.pop('image_b64'))
         if image is None:
-            result['errors'].append("Invalid image format")
-            return result
+            task['decode_error'] = error
+            return self._fail(task, error)
+        
+        task['image'] = image
+        return task
+    
+    def stage_detect(self, task: Dict) -> Dict:
+        image = task['image']
         
         # Detect faces
-        face_data_list, error = self.detect_faces(image)
+        face_data_list, error = self.detect_faces(image, task['detector'])
         if error:
-            result['errors'].append(error)
-            return result
+            return self._fail(task, error)
         
         face_data = face_data_list[0]
         
         # Validate human face
         is_human, error = self.is_human_face(image, face_data)
         if not is_human:
+            return self._fail(task, error)
+        
+        task['face_data'] = face_data
+        
+        if task['kind'] == 'detection':
+            task['result'].update(success=True, faces=1, message='Human face detected successfully')
+            task['done'] = True
+        return task
+    
+    def stage_embed(self, task: Dict) -> Dict:
+        # Generate encoding; the decoded frame is released afterwards
+        encoding = self.generate_face_encoding(task['image'], task['face_data'])
+        self.release_frame(task)
+        if encoding is None:
+            return self._fail(task, "Failed to generate face encoding")
+        
+        task['encoding'] = encoding
+        return task
+    
+    def stage_match(self, task: Dict) -> Dict:
+        result = task['result']
+        task['done'] = True
+        
+        if task['kind'] == 'registration':
+            result['success'] = True
+            result['encoding'] = task['encoding']
+            return task
+        
+        if task.get('return_encoding'):
+            result['encoding'] = task['encoding']
+        
+        gallery, error = self.resolve_gallery(task['students'], task.get('gallery_key'), task.get('gallery_version'))
+        if gallery is None:
+            if error == self.GALLERY_MISSING:
+                result['galleryMissing'] = True
             result['errors'].append(error)
-            return result
+            return task
         
-        # Generate encoding
-        captured_encoding = self.generate_face_encoding(image, face_data)
-        if captured_encoding is None:
-            result['errors'].append("Failed to generate face encoding")
-            return result
+        if len(gallery) and gallery.matrix.shape[1] != len(task['encoding']):
+            result['errors'].append(f"Student encodings must have {len(task['encoding'])} values")
+            return task
         
-        print(f"[Recognition] Comparing with {len(student_encodings)} stored encodings...")
+        print(f"[Recognition] Comparing with {len(gallery)} stored encodings...")
         
-        # Compare with all student encodings
-        best_match = None
-        best_confidence = 0.0
+        with record_function('gallery.match'):
+            candidates = self.score_candidates(task['encoding'], gallery, task.get('top_k', 0))
+            best_match, best_confidence = self._best_of(candidates)
         
-        for student_id, student_data in student_encodings.items():
-            stored_encoding = student_data.get('encoding')
-            if not stored_encoding:
-                print(f"[Recognition] Student {student_id} has no encoding, skipping")
-                continue
-            
-            confidence, is_match = self.match_face_encoding(
-                stored_encoding, 
-                captured_encoding
-            )
-            
-            print(f"[Recognition] Student {student_id}: confidence={confidence:.2f}%, match={is_match}")
-            
-            if is_match and confidence > best_confidence:
-                best_confidence = confidence
-                best_match = {
-                    'studentId': student_id,
-                    'confidence': confidence,
-                    'name': student_data.get('name', 'Unknown'),
-                    'rollNumber': student_data.get('rollNumber', '')
-                }
+        if task.get('top_k'):
+            result['candidates'] = candidates[:task['top_k']]
         
         if best_match:
             result['success'] = True
@@ -420,4 +729,75 @@ class FaceRecognitionService:
             result['errors'].append("No matching student found - face not registered or confidence too low")
             print(f"[Recognition] ❌ No match found. Best confidence was {best_confidence:.2f}%")
         
-        return result
+        return task
+    
+    def resolve_gallery(self, student_encodings: Dict[str, Dict], key: Optional[str] = None,
+                        version: Optional[str] = None) -> Tuple[Optional[StudentGallery], str]:
+        """
+        Gallery to match against
+        
+        With a key and version, the resident gallery is used when it is at
+        that version (student_encodings may then be empty); otherwise it is
+        built from student_encodings and, with a key and version, kept
+        resident for the next request.
+        
+        Returns:
+            (gallery, error_message) - GALLERY_MISSING when the gallery is not
+            resident and no students were sent
+        """
+        if key and version:
+            gallery = self.galleries.get(key, version)
+            if gallery is not None:
+                return gallery, ""
+        
+        if not student_encodings:
+            return None, self.GALLERY_MISSING if key and version else "No student data provided"
+        
+        try:
+            gallery = StudentGallery.from_students(student_encodings)
+        except (ValueError, TypeError, AttributeError) as e:
+            return None, f"Invalid student encodings: {e}"
+        
+        if key and version:
+            self.galleries.put(key, version, gallery)
+        return gallery, ""
+    
+    def score_candidates(self, captured_encoding: List[float], gallery: StudentGallery,
+                         top_k: int = 0) -> List[Dict]:
+        """
+        Score a captured encoding against a gallery
+        
+        One matrix-vector product over the normalized gallery; the best
+        max(top_k, 1) students are returned with SIMILARITY_THRESHOLD
+        applied to their cosine similarity.
+        
+        Returns:
+            [{'studentId', 'confidence', 'name', 'rollNumber', 'match'}] sorted best first
+        """
+        candidates = []
+        
+        for student_id, similarity in gallery.top_k(np.asarray(captured_encoding), max(top_k, 1)):
+            details = gallery.details.get(student_id, {})
+            confidence = round(similarity_to_confidence(similarity), 2)
+            is_match = similarity >= self.SIMILARITY_THRESHOLD
+            
+            print(f"[Recognition] Student {student_id}: confidence={confidence:.2f}%, match={is_match}")
+            
+            candidates.append({
+                'studentId': student_id,
+                'confidence': confidence,
+                'name': details.get('name', 'Unknown'),
+                'rollNumber': details.get('rollNumber', ''),
+                'match': bool(is_match)
+            })
+        
+        return candidates
+    
+    @staticmethod
+    def _best_of(candidates: List[Dict]) -> Tuple[Optional[Dict], float]:
+        """Highest-confidence matching candidate (without the 'match' flag) and its confidence"""
+        for candidate in candidates:
+            if candidate['match']:
+                best_match = {key: value for key, value in candidate.items() if key != 'match'}
+                return best_match, candidate['confidence']
+        return None, 0.0
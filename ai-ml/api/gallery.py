@@ -0,0 +1,146 @@
+"""
+Resident Student Galleries
+Class galleries kept in memory between attendance requests, keyed by
+schoolId/classId and a caller-supplied version, so callers can stop
+re-sending (and the service stop re-decoding) every student's encoding
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from api.memory import LOW_MEMORY_MODE
+from api.similarity import decode_embeddings, l2_normalize
+
+
+class StudentGallery:
+    """
+    One gallery of students as a row-normalized float32 matrix
+
+    - 2 KB per 512-D embedding (half of the float64 arrays built per request)
+    - Scored with one matrix-vector product; scores are exact cosine
+      similarities, so SIMILARITY_THRESHOLD applies to them directly
+    """
+
+    DETAIL_BYTES = 256   # Rough per-student size of the id / name / roll number
+
+    def __init__(self, ids: List[str], embeddings: np.ndarray, details: Optional[Dict[str, Dict]] = None):
+        """
+        Args:
+            ids: Student ids, one per row
+            embeddings: (n, dim) embeddings, any float dtype
+            details: {student_id: {'name': str, 'rollNumber': str}}
+        """
+        if len(ids) != len(embeddings):
+            raise ValueError(f"Got {len(ids)} ids for {len(embeddings)} embeddings")
+
+        self.ids = list(ids)
+        self.matrix = l2_normalize(embeddings)
+        self.details = details or {}
+
+    @classmethod
+    def from_students(cls, students: Dict[str, Dict]) -> 'StudentGallery':
+        """
+        Build a gallery from the /api/recognize-attendance students format
+
+        Students without an encoding are skipped.
+
+        Raises:
+            ValueError: if the encodings are malformed
+        """
+        ids, embeddings = decode_embeddings(students)
+        details = {
+            student_id: {
+                'name': students[student_id].get('name', 'Unknown'),
+                'rollNumber': students[student_id].get('rollNumber', '')
+            }
+            for student_id in ids
+        }
+        return cls(ids, embeddings, details)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate resident size"""
+        return self.matrix.nbytes + len(self.ids) * self.DETAIL_BYTES
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """
+        Cosine similarity of one query against every student
+
+        Args:
+            query: (dim,) embedding, normalized here
+
+        Returns:
+            (n,) float32 scores
+        """
+        query = l2_normalize(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        return self.matrix @ query
+
+    def top_k(self, query: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        """
+        Best k students by cosine similarity
+
+        Returns:
+            [(student_id, similarity)] sorted best first
+        """
+        if len(self) == 0:
+            return []
+
+        scores = self.scores(query)
+        k = min(max(1, k), len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(self.ids[i], float(scores[i])) for i in best]
+
+
+class GalleryStore:
+    """
+    Thread-safe LRU of StudentGallery objects bounded by total bytes
+
+    Each gallery is stored with the version the caller sent; a lookup with
+    any other version misses, so the caller decides when a gallery is stale
+    (e.g. after a student is added, removed or re-registered).
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        """
+        Args:
+            max_bytes: Memory budget (default: $GALLERY_CACHE_MB, or 64 MB / 16 MB in low-memory mode)
+        """
+        if max_bytes is None:
+            default_mb = 16 if LOW_MEMORY_MODE else 64
+            max_bytes = int(float(os.environ.get('GALLERY_CACHE_MB', default_mb)) * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self._galleries: 'OrderedDict[str, Tuple[str, StudentGallery]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str, version: str) -> Optional[StudentGallery]:
+        with self._lock:
+            entry = self._galleries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._galleries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, version: str, gallery: StudentGallery):
+        with self._lock:
+            previous = self._galleries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1].nbytes
+
+            if gallery.nbytes > self.max_bytes:
+                return  # Larger than the whole budget - never kept
+
+            self._galleries[key] = (version, gallery)
+            self._bytes += gallery.nbytes
+
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._galleries.popitem(last=False)
+                self._bytes -= evicted.nbytes
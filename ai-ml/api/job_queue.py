@@ -0,0 +1,396 @@
+"""
+Durable Job Queue for long-running recognition requests
+SQLite-backed so queued work survives worker restarts
+Finished jobs are evicted after a configurable TTL
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class JobQueue:
+    """
+    Local durable job queue backed by SQLite on the container's disk
+
+    Features:
+    - Submit returns a job id immediately, work runs on background threads
+    - Running jobs heartbeat their lease; jobs left 'running' by a dead worker
+      are re-claimed once the lease expires, and a worker that lost its lease
+      cannot overwrite the new owner's result
+    - Safe to share between Gunicorn worker processes (atomic claim)
+    - Poll or long-poll for results
+    - Finished jobs are deleted once their TTL expires
+    """
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    MAX_ATTEMPTS = 3           # Give up on jobs that keep killing their worker
+    MAX_WAIT_SECONDS = 30      # Upper bound for long-poll requests
+    SYNC_MAX_WAIT_SECONDS = 2  # Upper bound when the server handles one request at a time
+
+    def __init__(self,
+                 handlers: Dict[str, Callable[[Dict], Dict]],
+                 batch_handler: Optional[Callable[[List[Dict], Callable[[int], None]], List[Dict]]] = None,
+                 db_path: Optional[str] = None,
+                 ttl_seconds: Optional[int] = None,
+                 lease_seconds: Optional[int] = None,
+                 poll_interval: float = 1.0):
+        """
+        Args:
+            handlers: {job_type: callable(payload) -> result dict}
+            batch_handler: Optional callable(items, on_progress(done)) -> results, used
+                           for batch jobs instead of running items one by one
+            db_path: SQLite file path (default: $JOB_DB_PATH or data/jobs.sqlite3)
+            ttl_seconds: How long finished jobs are kept (default: $JOB_TTL_SECONDS or 3600)
+            lease_seconds: How long a running job may go without finishing before
+                           heartbeat before another worker re-claims it
+                           (default: $JOB_LEASE_SECONDS or 60)
+            poll_interval: Seconds between queue polls when idle
+        """
+        self.handlers = dict(handlers)
+        self.batch_handler = batch_handler
+        self.db_path = db_path or os.environ.get('JOB_DB_PATH', os.path.join('data', 'jobs.sqlite3'))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else int(os.environ.get('JOB_TTL_SECONDS', 3600))
+        self.lease_seconds = lease_seconds if lease_seconds is not None else int(os.environ.get('JOB_LEASE_SECONDS', 60))
+        self.poll_interval = poll_interval
+
+        self._worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._changed = threading.Condition()
+        self._last_eviction = 0.0
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._init_db()
+
+    # ------------------------------------------------------------------
+    # Storage
+    # ------------------------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT,
+                    result TEXT,
+                    error TEXT,
+                    progress INTEGER NOT NULL DEFAULT 0,
+                    total INTEGER NOT NULL DEFAULT 1,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    created_at REAL NOT NULL,
+                    claimed_at REAL,
+                    finished_at REAL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)')
+        finally:
+            conn.close()
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def submit(self, job_type: str, payload: Dict) -> str:
+        """
+        Enqueue a job
+
+        Args:
+            job_type: One of the registered handler names or 'batch'
+            payload: JSON-serializable job input
+
+        Returns:
+            job id
+        """
+        if job_type != 'batch' and job_type not in self.handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+
+        job_id = uuid.uuid4().hex
+        total = len(payload.get('items', [])) if job_type == 'batch' else 1
+
+        conn = self._connect()
+        try:
+            conn.execute(
+                'INSERT INTO jobs (id, type, status, payload, total, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, job_type, self.STATUS_QUEUED, json.dumps(payload), total, time.time())
+            )
+        finally:
+            conn.close()
+
+        print(f"[Jobs] Queued {job_type} job {job_id}")
+        self._notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """
+        Fetch job status and result
+
+        Returns:
+            Job dict or None if unknown / evicted
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT id, type, status, result, error, progress, total, created_at, finished_at '
+                'FROM jobs WHERE id = ?',
+                (job_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+
+        if row is None:
+            return None
+
+        return {
+            'jobId': row['id'],
+            'type': row['type'],
+            'status': row['status'],
+            'progress': row['progress'],
+            'total': row['total'],
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+            'createdAt': row['created_at'],
+            'finishedAt': row['finished_at']
+        }
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Dict]:
+        """
+        Long-poll: block until the job finishes or timeout expires
+
+        Completion in this process wakes the waiter immediately; completion
+        in another Gunicorn worker is picked up on the next poll tick.
+        """
+        deadline = time.time() + min(max(timeout, 0), self.MAX_WAIT_SECONDS)
+
+        while True:
+            job = self.get(job_id)
+            if job is None or job['status'] in (self.STATUS_DONE, self.STATUS_FAILED):
+                return job
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return job
+
+            with self._changed:
+                self._changed.wait(timeout=min(self.poll_interval, remaining))
+
+    def start(self, workers: int = 1):
+        """Start background worker threads (idempotent)"""
+        if self._threads:
+            return
+
+        self._stop.clear()
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        print(f"[Jobs] Started {workers} worker(s), db={self.db_path}, ttl={self.ttl_seconds}s")
+
+    def stop(self):
+        """Stop worker threads after their current job"""
+        self._stop.set()
+        self._notify()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    # ------------------------------------------------------------------
+    # Worker loop
+    # ------------------------------------------------------------------
+
+    def _claim(self) -> Optional[Tuple[sqlite3.Row, str]]:
+        """
+        Atomically claim the oldest queued (or abandoned) job
+
+        Returns:
+            (row, claim) or None; claim identifies this lease in the worker column
+        """
+        now = time.time()
+        claim = f"{self._worker_id}-{uuid.uuid4().hex[:8]}"
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT id, type, payload, attempts FROM jobs '
+                'WHERE status = ? OR (status = ? AND claimed_at < ?) '
+                'ORDER BY created_at LIMIT 1',
+                (self.STATUS_QUEUED, self.STATUS_RUNNING, now - self.lease_seconds)
+            ).fetchone()
+
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+
+            if row['attempts'] >= self.MAX_ATTEMPTS:
+                conn.execute(
+                    'UPDATE jobs SET status = ?, error = ?, payload = NULL, finished_at = ? WHERE id = ?',
+                    (self.STATUS_FAILED, 'Job abandoned after repeated worker failures', now, row['id'])
+                )
+                conn.execute('COMMIT')
+                return None
+
+            conn.execute(
+                'UPDATE jobs SET status = ?, worker = ?, claimed_at = ?, attempts = attempts + 1 WHERE id = ?',
+                (self.STATUS_RUNNING, claim, now, row['id'])
+            )
+            conn.execute('COMMIT')
+            return row, claim
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def _finish(self, job_id: str, claim: str, status: str, result: Optional[Dict], error: Optional[str]) -> bool:
+        """Store the outcome; False if the lease was lost to another worker"""
+        conn = self._connect()
+        try:
+            # Payload (base64 images) is dropped as soon as it is no longer needed
+            cursor = conn.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, payload = NULL, '
+                'progress = total, finished_at = ? WHERE id = ? AND worker = ?',
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id, claim)
+            )
+            updated = cursor.rowcount > 0
+        finally:
+            conn.close()
+        self._notify()
+        return updated
+
+    def _set_progress(self, job_id: str, claim: str, progress: int):
+        conn = self._connect()
+        try:
+            conn.execute(
+                'UPDATE jobs SET progress = ?, claimed_at = ? WHERE id = ? AND worker = ?',
+                (progress, time.time(), job_id, claim)
+            )
+        finally:
+            conn.close()
+
+    def _heartbeat(self, job_id: str, claim: str, done: threading.Event):
+        """Refresh the lease every third of its length until the job finishes"""
+        interval = max(self.lease_seconds / 3, 0.1)
+        while not done.wait(interval):
+            try:
+                conn = self._connect()
+                try:
+                    cursor = conn.execute(
+                        'UPDATE jobs SET claimed_at = ? WHERE id = ? AND worker = ? AND status = ?',
+                        (time.time(), job_id, claim, self.STATUS_RUNNING)
+                    )
+                    if cursor.rowcount == 0:
+                        print(f"[Jobs] Lost lease on job {job_id}")
+                        return
+                finally:
+                    conn.close()
+            except Exception as e:
+                print(f"[Jobs] Heartbeat error for {job_id}: {e}")
+
+    def evict_expired(self) -> int:
+        """Delete finished jobs older than the TTL"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                'DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?',
+                (self.STATUS_DONE, self.STATUS_FAILED, time.time() - self.ttl_seconds)
+            )
+            evicted = cursor.rowcount
+        finally:
+            conn.close()
+
+        if evicted:
+            print(f"[Jobs] Evicted {evicted} expired job(s)")
+        return evicted
+
+    def _execute(self, job_id: str, claim: str, job_type: str, payload: Dict) -> Dict:
+        if job_type != 'batch':
+            return self.handlers[job_type](payload)
+
+        items = payload.get('items', [])
+        if self.batch_handler is not None:
+            results = self.batch_handler(items, lambda done: self._set_progress(job_id, claim, done))
+            return {'success': True, 'results': results}
+
+        # Batch: run each item through its own handler, recording progress so
+        # pollers can see how far along the job is
+        results = []
+        for index, item in enumerate(items):
+            handler = self.handlers.get(item.get('type'))
+            if handler is None:
+                results.append({'success': False, 'errors': [f"Unknown job type: {item.get('type')}"]})
+            else:
+                try:
+                    results.append(handler(item))
+                except Exception as e:
+                    print(f"[Jobs] Batch item {index} of {job_id} failed: {e}")
+                    results.append({'success': False, 'errors': [f'Internal server error: {str(e)}']})
+            self._set_progress(job_id, claim, index + 1)
+
+        return {'success': True, 'results': results}
+
+    def _run(self):
+        while not self._stop.is_set():
+            if time.time() - self._last_eviction > 60:
+                self._last_eviction = time.time()
+                try:
+                    self.evict_expired()
+                except Exception as e:
+                    print(f"[Jobs] Eviction error: {e}")
+
+            try:
+                claimed = self._claim()
+            except Exception as e:
+                print(f"[Jobs] Claim error: {e}")
+                claimed = None
+
+            if claimed is None:
+                with self._changed:
+                    self._changed.wait(timeout=self.poll_interval)
+                continue
+
+            row, claim = claimed
+            job_id, job_type = row['id'], row['type']
+            print(f"[Jobs] Running {job_type} job {job_id} (attempt {row['attempts'] + 1})")
+            started = time.time()
+
+            done = threading.Event()
+            threading.Thread(target=self._heartbeat, args=(job_id, claim, done), daemon=True).start()
+            try:
+                result = self._execute(job_id, claim, job_type, json.loads(row['payload'] or '{}'))
+                status, error = self.STATUS_DONE, None
+            except Exception as e:
+                print(f"[Jobs] ❌ Job {job_id} failed: {e}")
+                result, status, error = None, self.STATUS_FAILED, str(e)
+            finally:
+                done.set()
+
+            if not self._finish(job_id, claim, status, result, error):
+                print(f"[Jobs] Job {job_id} was re-claimed by another worker, result discarded")
+            elif status == self.STATUS_DONE:
+                print(f"[Jobs] ✅ Job {job_id} done in {time.time() - started:.2f}s")
@@ -0,0 +1,250 @@
+"""
+Memory Budget and Low-Footprint Mode
+Per-process RSS budget, input downscaling / rejection and per-request peak RSS reporting
+"""
+
+import ctypes
+import ctypes.util
+import gc
+import os
+import resource
+import threading
+import time
+from typing import Optional, Tuple
+
+from flask import Flask, g, request
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value not in (None, '') else default
+
+
+LOW_MEMORY_MODE = os.environ.get('LOW_MEMORY_MODE', '0') == '1'
+
+MB = 1024 * 1024
+
+
+def current_rss() -> int:
+    """Current resident set size in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+def peak_rss() -> int:
+    """Peak RSS in bytes since process start (or the last reset_peak_rss)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    # ru_maxrss is KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_rss() -> bool:
+    """Reset the kernel's peak-RSS counter (Linux >= 4.0); False if unsupported"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+_libc = None
+
+
+def release_memory():
+    """Collect garbage and hand freed heap pages back to the OS (glibc only)"""
+    global _libc
+    gc.collect()
+
+    if _libc is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6')
+            _libc = libc if hasattr(libc, 'malloc_trim') else False
+        except OSError:
+            _libc = False
+    if _libc:
+        _libc.malloc_trim(0)
+
+
+class MemoryBudget:
+    """
+    Decides how (or whether) an uploaded image can be decoded within the
+    per-process memory budget
+
+    Each admitted image reserves the working set of its decoded frame until
+    the frame is released (after embedding), so concurrent uploads and
+    frames waiting in the pipeline queues are counted against the budget
+    along with the current RSS.
+
+    Settings (environment):
+        LOW_MEMORY_MODE=1    enable the defaults below
+        MEMORY_BUDGET_MB     max RSS for the process (0 = unlimited)
+        MAX_IMAGE_SIDE       longest side after decoding (0 = unlimited, 1280 in low-memory mode)
+        MAX_UPLOAD_MB        max encoded image size (0 = unlimited, 8 in low-memory mode)
+    """
+
+    # Working set per decoded pixel: BGR + RGB + PIL copies (9 B) plus the
+    # MTCNN float32 image pyramid (~16 B), rounded up
+    BYTES_PER_PIXEL = 28
+
+    def __init__(self):
+        self.low_memory = LOW_MEMORY_MODE
+        self.budget_bytes = int(_env_float('MEMORY_BUDGET_MB', 0) * MB)
+        self.max_side = int(_env_float('MAX_IMAGE_SIDE', 1280 if self.low_memory else 0))
+        self.max_upload_bytes = int(_env_float('MAX_UPLOAD_MB', 8 if self.low_memory else 0) * MB)
+        self._reserved = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.low_memory or bool(self.budget_bytes or self.max_side or self.max_upload_bytes)
+
+    def check_upload(self, encoded_bytes: int) -> str:
+        """Error message if the compressed upload is over the limit, else empty string"""
+        if self.max_upload_bytes and encoded_bytes > self.max_upload_bytes:
+            return (f"Image too large ({encoded_bytes / MB:.1f} MB, max {self.max_upload_bytes / MB:.0f} MB) "
+                    "- please upload a smaller photo")
+        return ""
+
+    @property
+    def reserved_bytes(self) -> int:
+        """Working set reserved for frames that are decoded or being decoded"""
+        return self._reserved
+
+    def frame_bytes(self, image) -> int:
+        """Working set reserved for a decoded frame (0 without a budget)"""
+        if not self.budget_bytes or image is None:
+            return 0
+        return image.shape[0] * image.shape[1] * self.BYTES_PER_PIXEL
+
+    def settle(self, reserved: int, image) -> int:
+        """
+        Replace a plan_decode reservation with the decoded frame's actual
+        working set (or drop it if decoding failed)
+
+        Returns:
+            the bytes now reserved for the frame - pass them to release()
+        """
+        actual = self.frame_bytes(image)
+        with self._lock:
+            self._reserved += actual - reserved
+        return actual
+
+    def release(self, nbytes: int):
+        """Give back a frame's reservation once the frame is dropped"""
+        if nbytes:
+            with self._lock:
+                self._reserved -= nbytes
+
+    def plan_decode(self, width: int, height: int, full_decode: bool = False) -> Tuple[int, Optional[float], int, str]:
+        """
+        Choose a decode-time reduction for an image of the given size and
+        reserve its working set
+
+        Args:
+            width, height: Encoded image size
+            full_decode: The format has no reduced decoding (PNG etc.): OpenCV
+                         decodes the full bitmap and then shrinks it
+
+        Returns:
+            (reduce, resize_scale, reserved, error)
+            reduce: 1, 2, 4 or 8 - decoded at 1/reduce size (directly for JPEG)
+            resize_scale: further cv2.resize factor (< 1) or None
+            reserved: bytes reserved for the frame - hand them to settle() after decoding
+            error: non-empty if the image cannot fit in the remaining budget
+        """
+        scale = 1.0
+        if self.max_side and max(width, height) > self.max_side:
+            scale = self.max_side / max(width, height)
+
+        if not self.budget_bytes:
+            return self._reduction(scale) + (0, "")
+
+        # Check and reserve in one step, so concurrent uploads cannot all be
+        # admitted against the same free memory
+        with self._lock:
+            available = self.budget_bytes - current_rss() - self._reserved
+            if available <= 0:
+                return 1, None, 0, "Server is over its memory budget - please retry shortly"
+            if full_decode and width * height * 3 > available:
+                return 1, None, 0, "Image too large for available memory - please upload a smaller photo or a JPEG"
+
+            needed = width * height * self.BYTES_PER_PIXEL * scale * scale
+            if needed > available:
+                scale *= (available / needed) ** 0.5
+            if scale < 1.0 / 8:
+                # Would need more than 8x reduction just to fit - faces would be too small anyway
+                return 1, None, 0, "Image too large for available memory - please upload a smaller photo"
+
+            reserved = int(width * height * self.BYTES_PER_PIXEL * scale * scale)
+            self._reserved += reserved
+
+        return self._reduction(scale) + (reserved, "")
+
+    @staticmethod
+    def _reduction(scale: float) -> Tuple[int, Optional[float]]:
+        """(reduce, resize_scale) reaching an overall scale factor"""
+        if scale >= 1.0:
+            return 1, None
+
+        # Largest power-of-two reduction that does not go below the target,
+        # so a JPEG's full-resolution bitmap is never materialized
+        reduce = 1
+        for factor in (2, 4, 8):
+            if 1.0 / factor >= scale:
+                reduce = factor
+
+        remaining = scale * reduce
+        return reduce, (remaining if remaining < 0.999 else None)
+
+
+class MemoryTracker:
+    """
+    Reports peak RSS per request via the X-Peak-RSS-MB header and logs
+
+    Peak is process-wide: with several threads per worker, concurrent
+    requests share the number.
+    """
+
+    def __init__(self, budget: MemoryBudget):
+        self.budget = budget
+        self.enabled = budget.enabled or os.environ.get('MEMORY_REPORT', '0') == '1'
+
+    def init_app(self, app: Flask):
+        if not self.enabled:
+            return
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        print(f"[Memory] Tracking enabled (low-memory mode: {self.budget.low_memory}, "
+              f"budget: {self.budget.budget_bytes // MB or 'unlimited'} MB, "
+              f"max side: {self.budget.max_side or 'unlimited'})")
+
+    def _before_request(self):
+        reset_peak_rss()
+        g.rss_start = current_rss()
+        g.rss_started_at = time.perf_counter()
+
+    def _after_request(self, response):
+        if 'rss_start' not in g:
+            return response
+
+        if self.budget.low_memory:
+            release_memory()
+
+        peak = peak_rss()
+        response.headers['X-Peak-RSS-MB'] = f"{peak / MB:.1f}"
+        if request.path != '/health':
+            print(f"[Memory] {request.method} {request.path}: peak RSS {peak / MB:.1f} MB "
+                  f"(+{max(0, peak - g.rss_start) / MB:.1f} MB), now {current_rss() / MB:.1f} MB, "
+                  f"{(time.perf_counter() - g.rss_started_at) * 1000:.0f} ms")
+        return response
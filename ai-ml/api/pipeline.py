@@ -0,0 +1,124 @@
+"""
+Staged Recognition Pipeline
+Bounded queues between decode, detect, embed and match so consecutive
+requests overlap (request N+1 is decoded/detected while N is embedded)
+
+Requests only overlap when the server handles several at once - run
+Gunicorn with threaded workers (--worker-class gthread --threads N)
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+StageFunc = Callable[[Dict], Dict]
+
+
+class StagedPipeline:
+    """
+    Multi-stage worker pipeline
+
+    - Each stage has its own worker threads and an input queue of bounded size,
+      so a slow stage applies back-pressure instead of buffering unbounded work
+    - Tasks are dicts; a stage may set task['done'] to skip the remaining stages
+      (e.g. no face detected)
+    - submit() returns a Future resolved with the final task
+    - on_finish(task) runs whenever a task leaves the pipeline, including
+      after a stage raised (e.g. to release resources the task still holds)
+    """
+
+    def __init__(self, stages: List[Tuple[str, StageFunc, int]], queue_size: int = 8,
+                 on_finish: Optional[Callable[[Dict], None]] = None):
+        """
+        Args:
+            stages: [(name, func(task) -> task, worker_count)] in execution order
+            queue_size: Capacity of each inter-stage queue
+            on_finish: Optional callable(task) run as a task leaves the pipeline
+        """
+        if not stages:
+            raise ValueError('Pipeline needs at least one stage')
+
+        self.stages = stages
+        self.on_finish = on_finish
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self._threads: List[threading.Thread] = []
+
+        for index, (name, func, workers) in enumerate(stages):
+            for i in range(max(1, workers)):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(index, func),
+                    name=f'pipeline-{name}-{i}',
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+        layout = ' -> '.join(f'{name}x{max(1, workers)}' for name, _, workers in stages)
+        print(f"[Pipeline] Started: {layout} (queue size {queue_size})")
+
+    def submit(self, task: Dict) -> Future:
+        """Queue a task at the first stage (blocks while that queue is full)"""
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self.queues[0].put((task, future))
+        return future
+
+    def run(self, task: Dict) -> Dict:
+        """Submit a task and wait for it to leave the last stage"""
+        return self.submit(task).result()
+
+    def _work(self, index: int, func: StageFunc):
+        inbox = self.queues[index]
+        is_last = index == len(self.stages) - 1
+
+        while True:
+            task, future = inbox.get()
+            try:
+                if not task.get('done'):
+                    task = func(task)
+            except Exception as e:
+                print(f"[Pipeline] Stage {self.stages[index][0]} failed: {e}")
+                self._finish(task)
+                future.set_exception(e)
+                continue
+
+            if is_last or task.get('done'):
+                self._finish(task)
+                future.set_result(task)
+            else:
+                self.queues[index + 1].put((task, future))
+
+    def _finish(self, task: Dict):
+        if self.on_finish is None:
+            return
+        try:
+            self.on_finish(task)
+        except Exception as e:
+            print(f"[Pipeline] on_finish failed: {e}")
+
+
+def build_recognition_pipeline(service) -> StagedPipeline:
+    """
+    Pipeline over FaceRecognitionService.stage_* methods
+
+    Worker counts per stage come from PIPELINE_<STAGE>_WORKERS
+    (defaults: decode 2, detect 1, embed 1, match 1) and the queue size
+    from PIPELINE_QUEUE_SIZE (default 8). torch stages default to one
+    worker each since torch already parallelizes inside an op.
+    """
+    defaults = {'decode': 2, 'detect': 1, 'embed': 1, 'match': 1}
+
+    stages = [
+        (
+            name,
+            getattr(service, f'stage_{name}'),
+            int(os.environ.get(f'PIPELINE_{name.upper()}_WORKERS', defaults.get(name, 1)))
+        )
+        for name in service.PIPELINE_STAGES
+    ]
+    return StagedPipeline(stages, queue_size=int(os.environ.get('PIPELINE_QUEUE_SIZE', 8)),
+                          on_finish=service.release_frame)
@@ -0,0 +1,263 @@
+"""
+On-Demand Request Profiling
+Captures cProfile and torch.profiler traces for selected requests
+Disabled (zero per-request work beyond one attribute check) unless PROFILE_TOKEN is set
+"""
+
+import contextlib
+import cProfile
+import fcntl
+import hmac
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from flask import Flask, g, request
+
+
+# Set while a torch.profiler trace is running in this process
+_torch_trace_active = threading.Event()
+_NO_TRACE = contextlib.nullcontext()
+
+
+def record_function(name: str):
+    """
+    Label a block in torch.profiler traces
+
+    Returns a shared no-op context unless a torch.profiler trace is running,
+    so labelled stages cost one flag check when profiling is off.
+    """
+    if not _torch_trace_active.is_set():
+        return _NO_TRACE
+
+    import torch.profiler
+    return torch.profiler.record_function(name)
+
+
+class RequestProfiler:
+    """
+    Opt-in per-request profiler
+
+    A request is profiled when either:
+    - it carries the header "X-Profile: <PROFILE_TOKEN>", or
+    - an operator armed the next N requests via POST /api/admin/profiling
+
+    Each profiled request writes to PROFILE_DIR:
+    - <id>.prof        cProfile stats (open with snakeviz / pstats)
+    - <id>.txt         top functions by cumulative time
+    - <id>.torch.json  torch.profiler Chrome trace (chrome://tracing / Perfetto)
+
+    Only the newest PROFILE_MAX_TRACES traces are kept.
+
+    The armed count lives in PROFILE_DIR/armed.json (guarded by flock), so
+    with several Gunicorn workers the next N requests are profiled
+    whichever worker serves them.
+
+    torch.profiler is process-wide: a trace also contains ops run by
+    pipeline and job threads for other requests in the same worker.
+    """
+
+    HEADER = 'X-Profile'
+    SUMMARY_LINES = 40
+    ARMED_FILE = 'armed.json'
+    LOCK_FILE = '.armed.lock'
+
+    def __init__(self,
+                 token: Optional[str] = None,
+                 trace_dir: Optional[str] = None,
+                 max_traces: Optional[int] = None):
+        """
+        Args:
+            token: Shared secret enabling profiling (default: $PROFILE_TOKEN, unset = disabled)
+            trace_dir: Output directory (default: $PROFILE_DIR or logs/profiles)
+            max_traces: Retention limit (default: $PROFILE_MAX_TRACES or 20)
+        """
+        self.token = token if token is not None else os.environ.get('PROFILE_TOKEN', '')
+        self.trace_dir = trace_dir or os.environ.get('PROFILE_DIR', os.path.join('logs', 'profiles'))
+        self.max_traces = max_traces if max_traces is not None else int(os.environ.get('PROFILE_MAX_TRACES', 20))
+
+        # torch.profiler is process-wide, so only one request is profiled at a time
+        self._active = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token)
+
+    def init_app(self, app: Flask):
+        """Register request hooks (no-op when profiling is disabled)"""
+        if not self.enabled:
+            return
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        print(f"[Profiling] Enabled - traces in {self.trace_dir} (keep {self.max_traces})")
+
+    # ------------------------------------------------------------------
+    # Arming
+    # ------------------------------------------------------------------
+
+    def check_token(self, token: Optional[str]) -> bool:
+        """Constant-time comparison with PROFILE_TOKEN"""
+        return self.enabled and token is not None and hmac.compare_digest(token.encode(), self.token.encode())
+
+    @contextlib.contextmanager
+    def _armed_state(self):
+        """Exclusive access to the armed state shared by all worker processes"""
+        os.makedirs(self.trace_dir, exist_ok=True)
+        with open(os.path.join(self.trace_dir, self.LOCK_FILE), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield os.path.join(self.trace_dir, self.ARMED_FILE)
+
+    @staticmethod
+    def _read_armed(path: str) -> Dict:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'armed': 0, 'path': None, 'torch': True}
+
+    def arm(self, count: int, path: Optional[str] = None, with_torch: bool = True):
+        """Profile the next `count` requests (optionally only those for `path`)"""
+        with self._armed_state() as state_path:
+            if count > 0:
+                with open(state_path, 'w') as f:
+                    json.dump({'armed': count, 'path': path, 'torch': with_torch}, f)
+            elif os.path.exists(state_path):
+                os.remove(state_path)
+        print(f"[Profiling] Armed for {count} request(s){' on ' + path if path else ''}")
+
+    def status(self) -> Dict:
+        with self._armed_state() as state_path:
+            state = self._read_armed(state_path)
+        return {
+            'enabled': self.enabled,
+            **state,
+            'traces': self.list_traces()
+        }
+
+    def _should_profile(self) -> Optional[bool]:
+        """None to skip, else whether to also run torch.profiler"""
+        if self.check_token(request.headers.get(self.HEADER)):
+            return True
+
+        # Cheap check first - the state file only exists while armed
+        if request.path.startswith('/api/admin/') or not os.path.exists(os.path.join(self.trace_dir, self.ARMED_FILE)):
+            return None
+
+        with self._armed_state() as state_path:
+            state = self._read_armed(state_path)
+            if state['armed'] <= 0 or (state['path'] and request.path != state['path']):
+                return None
+
+            state['armed'] -= 1
+            if state['armed'] > 0:
+                with open(state_path, 'w') as f:
+                    json.dump(state, f)
+            else:
+                os.remove(state_path)
+            return state['torch']
+
+    # ------------------------------------------------------------------
+    # Request hooks
+    # ------------------------------------------------------------------
+
+    def _before_request(self):
+        with_torch = self._should_profile()
+        if with_torch is None:
+            return
+        if not self._active.acquire(blocking=False):
+            print(f"[Profiling] Skipping {request.path} - another request is being profiled")
+            return
+
+        g.profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint or 'unknown'}-{uuid.uuid4().hex[:6]}"
+        g.profile_started = time.perf_counter()
+        g.torch_profiler = None
+
+        if with_torch:
+            try:
+                import torch.profiler
+                g.torch_profiler = torch.profiler.profile(
+                    activities=[torch.profiler.ProfilerActivity.CPU],
+                    record_shapes=True
+                )
+                g.torch_profiler.__enter__()
+                _torch_trace_active.set()
+            except Exception as e:
+                print(f"[Profiling] torch.profiler unavailable: {e}")
+                g.torch_profiler = None
+
+        g.cprofile = cProfile.Profile()
+        g.cprofile.enable()
+
+    def _after_request(self, response):
+        if 'cprofile' in g:
+            self._finish(response.status_code)
+            response.headers['X-Profile-Id'] = g.profile_id
+        return response
+
+    def _teardown_request(self, exc=None):
+        # Runs after _after_request; only does work if the request died first
+        if 'cprofile' in g:
+            self._finish(500)
+
+    def _finish(self, status_code: int):
+        profile = g.pop('cprofile')
+        profile.disable()
+        torch_profiler = g.pop('torch_profiler', None)
+        elapsed = time.perf_counter() - g.profile_started
+
+        try:
+            if torch_profiler is not None:
+                _torch_trace_active.clear()
+                torch_profiler.__exit__(None, None, None)
+            self._write(g.profile_id, profile, torch_profiler, elapsed, status_code)
+        except Exception as e:
+            print(f"[Profiling] Failed to write trace {g.profile_id}: {e}")
+        finally:
+            self._active.release()
+
+    # ------------------------------------------------------------------
+    # Storage
+    # ------------------------------------------------------------------
+
+    def _write(self, profile_id: str, profile: cProfile.Profile, torch_profiler, elapsed: float, status_code: int):
+        os.makedirs(self.trace_dir, exist_ok=True)
+        base = os.path.join(self.trace_dir, profile_id)
+
+        profile.dump_stats(base + '.prof')
+
+        summary = io.StringIO()
+        summary.write(f"{request.method} {request.path} -> {status_code} in {elapsed * 1000:.1f} ms\n\n")
+        pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(self.SUMMARY_LINES)
+
+        if torch_profiler is not None:
+            torch_profiler.export_chrome_trace(base + '.torch.json')
+            summary.write('\ntorch.profiler (self CPU time; process-wide - includes ops run by pipeline '
+                          'and job threads for other requests in this worker):\n')
+            summary.write(torch_profiler.key_averages().table(sort_by='self_cpu_time_total', row_limit=25))
+
+        with open(base + '.txt', 'w') as f:
+            f.write(summary.getvalue())
+
+        print(f"[Profiling] Saved {profile_id} ({elapsed * 1000:.1f} ms)")
+        self._enforce_retention()
+
+    def list_traces(self) -> List[str]:
+        """Trace ids, newest first"""
+        if not os.path.isdir(self.trace_dir):
+            return []
+        ids = {name.split('.', 1)[0] for name in os.listdir(self.trace_dir) if name.endswith('.prof')}
+        return sorted(ids, reverse=True)
+
+    def _enforce_retention(self):
+        for profile_id in self.list_traces()[self.max_traces:]:
+            for suffix in ('.prof', '.txt', '.torch.json'):
+                path = os.path.join(self.trace_dir, profile_id + suffix)
+                if os.path.exists(path):
+                    os.remove(path)
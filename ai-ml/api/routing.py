@@ -0,0 +1,534 @@
+"""
+Gallery Sharding and Request Routing
+Consistent hashing of schoolId/classId galleries onto recognition nodes, so
+each node keeps only its share of galleries resident in its GalleryStore
+"""
+
+import bisect
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+def shard_key(school_id, class_id=None) -> str:
+    """Placement key of a gallery; one class is the unit of placement"""
+    return f"{school_id or ''}/{class_id or ''}"
+
+
+class ConsistentHashRing:
+    """
+    Hash ring with virtual nodes
+
+    - Each node owns the arcs ending at its virtual points
+    - Adding a node only moves the keys on the arcs it takes over (~1/N),
+      so the other nodes keep their resident galleries
+    - Virtual nodes even out the share of each node when N is small
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = 64):
+        self.vnodes = max(1, vnodes)
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        self.nodes: List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+    def add(self, node: str):
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for i in range(self.vnodes):
+            point = self._hash(f"{node}#{i}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node: str):
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        keep = [i for i, owner in enumerate(self._owners) if owner != node]
+        self._points = [self._points[i] for i in keep]
+        self._owners = [self._owners[i] for i in keep]
+
+    def _owner_at(self, point: int) -> str:
+        return self._owners[bisect.bisect(self._points, point) % len(self._points)]
+
+    def node_for(self, key: str) -> str:
+        if not self._points:
+            raise LookupError('Hash ring has no nodes')
+        return self._owner_at(self._hash(key))
+
+    def shares(self) -> Dict[str, float]:
+        """Fraction of the key space owned by each node"""
+        size = 1 << 64
+        shares = {node: 0.0 for node in self.nodes}
+        for i, point in enumerate(self._points):
+            # The point at index i owns the arc from the previous point up to it
+            previous = self._points[i - 1] if i else self._points[-1] - size
+            shares[self._owners[i]] += (point - previous) / size
+        return shares
+
+    def moved_share(self, other: 'ConsistentHashRing') -> float:
+        """Fraction of the key space owned by a different node in `other`"""
+        if not self._points or not other._points:
+            return 1.0
+
+        size = 1 << 64
+        bounds = sorted(set(self._points) | set(other._points))
+        moved = 0
+        for i, start in enumerate(bounds):
+            # Keys in [start, next bound) have the same owner in both rings
+            end = bounds[i + 1] if i + 1 < len(bounds) else bounds[0] + size
+            if self._owner_at(start) != other._owner_at(start):
+                moved += end - start
+        return moved / size
+
+
+class HttpNode:
+    """Recognition node reached over HTTP (another instance of this API)"""
+
+    def __init__(self, url: str, timeout: float):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def post(self, path: str, payload: Dict) -> Tuple[int, Dict]:
+        request = urllib.request.Request(
+            self.url + path,
+            data=json.dumps(payload).encode(),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                return e.code, json.loads(e.read())
+            except ValueError:
+                return e.code, {}
+
+
+class LocalNode:
+    """
+    In-process stand-in for a recognition node
+
+    Dispatches through the Flask test client of this app, so routing,
+    fan-out and rebalancing can be exercised on one machine.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def post(self, path: str, payload: Dict) -> Tuple[int, Dict]:
+        response = self.app.test_client().post(path, json=payload)
+        return response.status_code, response.get_json(silent=True) or {}
+
+
+class RecognitionRouter:
+    """
+    Routes attendance requests to the node that owns each class gallery
+
+    Features:
+    - Single-class requests are forwarded whole to the owning node
+    - Requests spanning several classes ("classes": {classId: students}) fan
+      out per class: the first class's node detects and embeds the face once
+      and returns the encoding, the other classes' nodes only match that
+      encoding, and the per-class top-k candidates are merged
+    - With galleryVersion / galleryVersions, each node keeps the class
+      galleries it owns resident (see FaceRecognitionService.resolve_gallery),
+      so requests for a class always reach the node that holds it
+    - Node membership lives in the SQLite file shared with the job queue, so
+      every Gunicorn worker routes with the same ring; a worker checks for
+      changes made by other workers at most every ROUTER_REFRESH_SECONDS
+    - Adding / removing a node reports the share of the key space that moved
+      and which recently routed galleries moved; a moved gallery is resent
+      to its new owner after a galleryMissing answer and ages out of the old
+      owner's LRU
+
+    Settings (environment):
+        RECOGNITION_NODES    comma-separated node URLs, or "local:N" for N
+                             in-process stand-in nodes (unset = no routing);
+                             a changed value replaces the stored membership
+        ROUTER_VNODES        virtual nodes per node (default 64)
+        ROUTER_TIMEOUT       per-node request timeout in seconds (default 55,
+                             below the backend's 60 s timeout)
+        ROUTER_TOP_K         candidates merged across shards (default 5)
+        ROUTER_RECENT_GALLERIES
+                             recently routed galleries remembered per worker
+                             for the moved report (default 10000)
+        ROUTER_REFRESH_SECONDS
+                             how stale this worker's view of the membership
+                             may get (default 1)
+        JOB_DB_PATH          SQLite file holding the membership
+                             (default data/jobs.sqlite3)
+    """
+
+    ATTENDANCE_PATH = '/api/recognize-attendance'
+    LOCAL = 'local'
+    MAX_FANOUT_THREADS = 8
+
+    def __init__(self, spec: str, local_app=None, db_path: Optional[str] = None):
+        """
+        Args:
+            spec: Initial membership - comma-separated URLs or "local:N"
+            local_app: Flask app serving the in-process "local" nodes
+            db_path: SQLite file (default: $JOB_DB_PATH or data/jobs.sqlite3)
+        """
+        self.local_app = local_app
+        self.timeout = float(os.environ.get('ROUTER_TIMEOUT', 55))
+        self.top_k = int(os.environ.get('ROUTER_TOP_K', 5))
+        self.vnodes = int(os.environ.get('ROUTER_VNODES', 64))
+        self.max_recent = int(os.environ.get('ROUTER_RECENT_GALLERIES', 10_000))
+        self.refresh_seconds = float(os.environ.get('ROUTER_REFRESH_SECONDS', 1))
+        self.db_path = db_path or os.environ.get('JOB_DB_PATH', os.path.join('data', 'jobs.sqlite3'))
+
+        self.nodes: Dict[str, object] = {}
+        self.ring = ConsistentHashRing((), self.vnodes)
+        self._version: Optional[int] = None
+        self._checked_at = 0.0
+        self._recent: 'OrderedDict[str, str]' = OrderedDict()   # Recent shard keys -> owning node
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._init_db(spec)
+        self._refresh(force=True)
+
+    @classmethod
+    def from_env(cls, local_app=None) -> Optional['RecognitionRouter']:
+        """Router configured from RECOGNITION_NODES, or None when unset"""
+        spec = os.environ.get('RECOGNITION_NODES', '').strip()
+        if not spec:
+            return None
+
+        router = cls(spec, local_app)
+        print(f"[Router] Routing across {len(router.nodes)} nodes: {', '.join(router.nodes)}")
+        return router
+
+    # ------------------------------------------------------------------
+    # Storage
+    # ------------------------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    @staticmethod
+    def _parse_spec(spec: str) -> List[str]:
+        if spec == 'local' or spec.startswith('local:'):
+            return ['local'] * int(spec.partition(':')[2] or 2)
+        return [url.strip() for url in spec.split(',') if url.strip()]
+
+    def _init_db(self, spec: str):
+        """Create the membership tables; (re)seed them when RECOGNITION_NODES changed"""
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS router_nodes (name TEXT PRIMARY KEY, address TEXT NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS router_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+            # Workers booting together all run this; the first one seeds, the rest see the same spec
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if self._meta(conn, 'spec') != spec:
+                    conn.execute('DELETE FROM router_nodes')
+                    for address in self._parse_spec(spec):
+                        self._insert_node(conn, address)
+                    self._set_meta(conn, 'spec', spec)
+                    self._bump_version(conn)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+        row = conn.execute('SELECT value FROM router_meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _set_meta(conn: sqlite3.Connection, key: str, value):
+        conn.execute('INSERT OR REPLACE INTO router_meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def _bump_version(self, conn: sqlite3.Connection):
+        self._set_meta(conn, 'version', int(self._meta(conn, 'version') or 0) + 1)
+
+    def _insert_node(self, conn: sqlite3.Connection, address: str) -> str:
+        if address == self.LOCAL:
+            # Monotonic, so a removed local node's name is never reused
+            number = int(self._meta(conn, 'next_local') or 0)
+            self._set_meta(conn, 'next_local', number + 1)
+            name = f"local-{number}"
+        else:
+            name = address.rstrip('/')
+            if conn.execute('SELECT 1 FROM router_nodes WHERE name = ?', (name,)).fetchone():
+                raise ValueError(f"Node already present: {name}")
+
+        conn.execute('INSERT INTO router_nodes (name, address) VALUES (?, ?)', (name, address))
+        return name
+
+    def _membership(self, conn: sqlite3.Connection) -> List[Tuple[str, str]]:
+        return conn.execute('SELECT name, address FROM router_nodes ORDER BY rowid').fetchall()
+
+    def _refresh(self, force: bool = False):
+        """
+        Reload the membership if another worker changed it
+
+        Checks the stored version at most every refresh_seconds (always when
+        forced); the query runs without holding the router lock.
+        """
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.refresh_seconds:
+            return
+        self._checked_at = now
+
+        conn = self._connect()
+        try:
+            version = int(self._meta(conn, 'version') or 0)
+            if version == self._version:
+                return
+            rows = self._membership(conn)
+        finally:
+            conn.close()
+
+        with self._lock:
+            if self._version is not None and version <= self._version:
+                return  # A concurrent refresh already loaded this (or a newer) membership
+
+            nodes = {}
+            for name, address in rows:
+                if name in self.nodes:
+                    nodes[name] = self.nodes[name]
+                elif address == self.LOCAL:
+                    if self.local_app is None:
+                        raise ValueError('Local nodes need the Flask app')
+                    nodes[name] = LocalNode(self.local_app)
+                else:
+                    nodes[name] = HttpNode(name, self.timeout)
+
+            self.nodes = nodes
+            self.ring = ConsistentHashRing(nodes, self.vnodes)
+            self._version = version
+
+    def _change(self, apply: Callable[[sqlite3.Connection], None]) -> Dict:
+        """Apply a membership change in one transaction and report what moved"""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                before = [name for name, _ in self._membership(conn)]
+                apply(conn)
+                after = [name for name, _ in self._membership(conn)]
+                self._bump_version(conn)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+
+        self._refresh(force=True)
+        return self._rebalance(ConsistentHashRing(before, self.vnodes), ConsistentHashRing(after, self.vnodes))
+
+    # ------------------------------------------------------------------
+    # Membership
+    # ------------------------------------------------------------------
+
+    def add_node(self, address: str) -> Dict:
+        """
+        Add a node by URL (or "local" for another in-process stand-in)
+
+        Returns:
+            {'share': fraction of the key space that moved,
+             'galleries': {shard_key: {'from': node, 'to': node}}} for the
+             recently routed galleries that moved
+        """
+        if address == self.LOCAL and self.local_app is None:
+            raise ValueError('Local nodes need the Flask app')
+        return self._change(lambda conn: self._insert_node(conn, address))
+
+    def remove_node(self, name: str) -> Dict:
+        """Remove a node; returns what moved (see add_node)"""
+        def apply(conn):
+            names = [row[0] for row in conn.execute('SELECT name FROM router_nodes')]
+            if name not in names:
+                raise KeyError(f"Unknown node: {name}")
+            if len(names) == 1:
+                raise ValueError('Cannot remove the last node')
+            conn.execute('DELETE FROM router_nodes WHERE name = ?', (name,))
+
+        return self._change(apply)
+
+    def _rebalance(self, old_ring: ConsistentHashRing, new_ring: ConsistentHashRing) -> Dict:
+        moves = {}
+        with self._lock:
+            for key, owner in self._recent.items():
+                new_owner = new_ring.node_for(key)
+                if new_owner != owner:
+                    moves[key] = {'from': owner, 'to': new_owner}
+                    self._recent[key] = new_owner
+            recent = len(self._recent)
+
+        share = old_ring.moved_share(new_ring)
+        print(f"[Router] Rebalanced: {share:.1%} of the key space moved, "
+              f"{len(moves)} of {recent} recent galleries")
+        return {'share': round(share, 4), 'galleries': moves}
+
+    def place(self, keys: List[str]) -> List[str]:
+        """Owning node of each shard key (membership checked once for the whole list)"""
+        self._refresh()
+        ring = self.ring
+        owners = [ring.node_for(key) for key in keys]
+
+        with self._lock:
+            for key, owner in zip(keys, owners):
+                self._recent[key] = owner
+                self._recent.move_to_end(key)
+            while len(self._recent) > self.max_recent:
+                self._recent.popitem(last=False)
+        return owners
+
+    def node_for(self, key: str) -> str:
+        return self.place([key])[0]
+
+    def status(self) -> Dict:
+        self._refresh(force=True)
+        ring = self.ring
+        share = ring.shares()
+        return {
+            'nodes': list(ring.nodes),
+            'vnodes': self.vnodes,
+            'keyspaceShare': {name: round(share.get(name, 0.0), 4) for name in ring.nodes},
+            'recentGalleries': len(self._recent)
+        }
+
+    # ------------------------------------------------------------------
+    # Forwarding
+    # ------------------------------------------------------------------
+
+    def _post(self, name: str, payload: Dict) -> Tuple[int, Dict]:
+        try:
+            return self.nodes[name].post(self.ATTENDANCE_PATH, payload)
+        except (OSError, ValueError, KeyError) as e:
+            # URLError, timeouts and refused connections are OSErrors;
+            # KeyError if the node was removed while the request was in flight
+            print(f"[Router] Node {name} failed: {e}")
+            return 502, {
+                'success': False,
+                'recognized': [],
+                'errors': [f'Recognition node {name} unavailable: {e}']
+            }
+
+    def recognize(self, data: Dict) -> Tuple[Dict, int, List[str]]:
+        """
+        Route an attendance request
+
+        Args:
+            data: /api/recognize-attendance payload with schoolId and either
+                  classId + students (+ galleryVersion), or
+                  classes: {classId: students} (+ galleryVersions: {classId: version});
+                  a class with a resident gallery may send empty students
+
+        Returns:
+            (response body, HTTP status, nodes used) - 409 with
+            "missingClasses" if a versioned gallery was not resident
+        """
+        school_id = data.get('schoolId')
+        classes = data.get('classes')
+
+        if not classes:
+            owner = self.node_for(shard_key(school_id, data.get('classId')))
+            status, body = self._post(owner, data)
+            return body, status, [owner]
+
+        class_ids = list(classes)
+        owners = self.place([shard_key(school_id, class_id) for class_id in class_ids])
+        versions = data.get('galleryVersions') or {}
+        top_k = data.get('topK') or self.top_k
+        base = {
+            key: value for key, value in data.items()
+            if key not in ('classes', 'students', 'classId', 'galleryVersion', 'galleryVersions')
+        }
+
+        def payload(class_id, extra):
+            forwarded = {**extra, 'classId': class_id, 'students': classes[class_id] or {}, 'topK': top_k}
+            if versions.get(class_id):
+                forwarded['galleryVersion'] = versions[class_id]
+            return forwarded
+
+        # The first class's node also detects and embeds (even if its gallery is missing)
+        status, body = self._post(owners[0], payload(class_ids[0], {**base, 'returnEncoding': True}))
+        encoding = body.pop('encoding', None)
+        if encoding is None:
+            # Decode / detection failed (or the node is down) - same answer for every class
+            return body, status, [owners[0]]
+
+        responses = [body]
+        if len(class_ids) > 1:
+            match_only = {key: value for key, value in base.items() if key != 'capturedImage'}
+            match_only['capturedEncoding'] = encoding
+            with ThreadPoolExecutor(max_workers=min(len(class_ids) - 1, self.MAX_FANOUT_THREADS)) as pool:
+                futures = [
+                    pool.submit(self._post, owner, payload(class_id, match_only))
+                    for class_id, owner in zip(class_ids[1:], owners[1:])
+                ]
+                responses.extend(future.result()[1] for future in futures)
+
+        nodes = list(dict.fromkeys(owners))
+        missing = [class_id for class_id, response in zip(class_ids, responses) if response.get('galleryMissing')]
+        if missing:
+            return {
+                'success': False,
+                'recognized': [],
+                'errors': [f"Gallery not resident for classes {', '.join(map(str, missing))} "
+                           f"- resend them with students"],
+                'galleryMissing': True,
+                'missingClasses': missing,
+                'shards': nodes
+            }, 409, nodes
+
+        return self._merge(responses, top_k, nodes), 200, nodes
+
+    @staticmethod
+    def _merge(responses: List[Dict], top_k: int, nodes: List[str]) -> Dict:
+        """Merge per-shard results into one attendance response with a global top-k"""
+        candidates = sorted(
+            (candidate for response in responses for candidate in response.get('candidates', [])),
+            key=lambda candidate: -candidate['confidence']
+        )[:top_k]
+
+        # Per-shard "no match" messages are replaced by one overall verdict
+        errors = [
+            error for response in responses for error in response.get('errors', [])
+            if not error.startswith('No matching student found')
+        ]
+
+        best = next((candidate for candidate in candidates if candidate.get('match')), None)
+        recognized = []
+        if best:
+            recognized.append({key: value for key, value in best.items() if key != 'match'})
+        else:
+            errors.append("No matching student found - face not registered or confidence too low")
+
+        return {
+            'success': bool(recognized),
+            'recognized': recognized,
+            'candidates': candidates,
+            'errors': errors,
+            'shards': nodes
+        }
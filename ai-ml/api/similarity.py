@@ -0,0 +1,266 @@
+"""
+Vectorized Embedding Similarity
+Blocked cosine-similarity matrix products for batched face verification
+and gallery-wide duplicate scans
+"""
+
+import base64
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+
+EMBEDDING_DIM = 512          # FaceNet embedding size
+DEFAULT_BLOCK_SIZE = 1024    # Rows/cols per block -> at most 4 MB float32 per block
+MIN_DUPLICATE_THRESHOLD = 0.3  # Lower thresholds pair (and cluster) most of a gallery
+PACKED_DTYPES = ('float32', 'float16', 'float64')
+
+
+def decode_embeddings(spec: Union[List, Dict]) -> Tuple[List[str], np.ndarray]:
+    """
+    Parse a set of embeddings from a request payload
+
+    Accepted formats:
+        [[512 floats], ...]                           -> ids are "0", "1", ...
+        {"id": [512 floats], ...}                     -> ids are the keys
+        {"id": {"encoding": [512 floats], ...}, ...}  -> /api/recognize-attendance students format
+        {"packed": "base64", "dtype": "float32", "dim": 512, "ids": [...]}
+                                                      -> little-endian row-major packed matrix
+
+    Returns:
+        (ids, matrix) where matrix is float32 of shape (n, dim)
+
+    Raises:
+        ValueError: if the payload is malformed
+    """
+    if isinstance(spec, dict) and 'packed' in spec:
+        dtype = spec.get('dtype', 'float32')
+        if dtype not in PACKED_DTYPES:
+            raise ValueError(f"Unsupported packed dtype: {dtype}")
+
+        dim = int(spec.get('dim', EMBEDDING_DIM))
+        raw = base64.b64decode(spec['packed'])
+        matrix = np.frombuffer(raw, dtype=np.dtype(dtype).newbyteorder('<'))
+
+        if dim <= 0 or matrix.size % dim != 0:
+            raise ValueError(f"Packed data length is not a multiple of dim={dim}")
+        matrix = matrix.reshape(-1, dim).astype(np.float32)
+
+        ids = spec.get('ids')
+        if ids is None:
+            ids = [str(i) for i in range(len(matrix))]
+        elif len(ids) != len(matrix):
+            raise ValueError(f"Got {len(ids)} ids for {len(matrix)} packed embeddings")
+        return [str(i) for i in ids], matrix
+
+    if isinstance(spec, dict):
+        ids, rows = [], []
+        for key, value in spec.items():
+            encoding = value.get('encoding') if isinstance(value, dict) else value
+            if not encoding:
+                continue  # Students without a registered face are skipped
+            ids.append(str(key))
+            rows.append(encoding)
+    elif isinstance(spec, list):
+        ids = [str(i) for i in range(len(spec))]
+        rows = spec
+    else:
+        raise ValueError('Embeddings must be a list, a mapping or a packed object')
+
+    if not rows:
+        return [], np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+
+    matrix = np.asarray(rows, dtype=np.float32)
+    if matrix.ndim != 2:
+        raise ValueError('All embeddings must have the same dimension')
+    return ids, matrix
+
+
+def l2_normalize(matrix: np.ndarray) -> np.ndarray:
+    """
+    Row-normalize embeddings so a dot product is a cosine similarity
+
+    Zero rows stay zero, matching cosine_similarity() returning 0.0 for them.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def iter_similarity_blocks(probes: np.ndarray,
+                           references: np.ndarray,
+                           block_size: int = DEFAULT_BLOCK_SIZE
+                           ) -> Iterator[Tuple[int, int, np.ndarray]]:
+    """
+    Yield cosine similarity blocks of probes x references
+
+    Args:
+        probes: (P, dim) L2-normalized float32
+        references: (R, dim) L2-normalized float32
+        block_size: Max rows and columns per block (bounds temporary memory)
+
+    Yields:
+        (row_offset, col_offset, block) with block of shape (<=block_size, <=block_size)
+    """
+    block_size = max(1, int(block_size))
+    for row in range(0, len(probes), block_size):
+        probe_block = probes[row:row + block_size]
+        for col in range(0, len(references), block_size):
+            yield row, col, probe_block @ references[col:col + block_size].T
+
+
+def similarity_matrix(probes: np.ndarray,
+                      references: np.ndarray,
+                      block_size: int = DEFAULT_BLOCK_SIZE) -> np.ndarray:
+    """Full (P, R) cosine similarity matrix computed block-wise"""
+    probes = l2_normalize(probes)
+    references = l2_normalize(references)
+
+    result = np.empty((len(probes), len(references)), dtype=np.float32)
+    for row, col, block in iter_similarity_blocks(probes, references, block_size):
+        result[row:row + block.shape[0], col:col + block.shape[1]] = block
+    return result
+
+
+def thresholded_pairs(probes: np.ndarray,
+                      references: np.ndarray,
+                      threshold: float,
+                      max_pairs: Optional[int] = None,
+                      block_size: int = DEFAULT_BLOCK_SIZE) -> Tuple[List[Tuple[int, int, float]], bool]:
+    """
+    All (probe_index, reference_index, similarity) with similarity >= threshold
+
+    Only the current block is materialized, and the result list stops
+    growing at max_pairs, so memory stays bounded even for a threshold
+    that matches everything.
+
+    Returns:
+        (pairs, truncated) - truncated is True if more than max_pairs matched
+    """
+    probes = l2_normalize(probes)
+    references = l2_normalize(references)
+
+    pairs = []
+    for row, col, block in iter_similarity_blocks(probes, references, block_size):
+        rows, cols = np.nonzero(block >= threshold)
+        if max_pairs is not None and len(pairs) + len(rows) > max_pairs:
+            keep = max_pairs - len(pairs)
+            rows, cols = rows[:keep], cols[:keep]
+            pairs.extend((row + r, col + c, float(block[r, c])) for r, c in zip(rows.tolist(), cols.tolist()))
+            return pairs, True
+        for r, c in zip(rows.tolist(), cols.tolist()):
+            pairs.append((row + r, col + c, float(block[r, c])))
+    return pairs, False
+
+
+def similarity_to_confidence(similarity):
+    """Map cosine similarity [-1, 1] to the 0-100 confidence used by the API"""
+    return (similarity + 1) / 2 * 100
+
+
+def iter_gallery_pairs(embeddings: np.ndarray,
+                       threshold: float,
+                       block_size: int = DEFAULT_BLOCK_SIZE
+                       ) -> Iterator[Tuple[int, List[Tuple[int, int, float]]]]:
+    """
+    All-pairs scan of one gallery against itself
+
+    Only blocks on or above the diagonal are computed, and only i < j pairs
+    are reported, so every unordered pair is scored exactly once.
+
+    Yields:
+        (rows_done, pairs) after each block row, pairs being
+        [(i, j, similarity)] with similarity >= threshold
+    """
+    gallery = l2_normalize(embeddings)
+    block_size = max(1, int(block_size))
+    n = len(gallery)
+
+    for row in range(0, n, block_size):
+        row_block = gallery[row:row + block_size]
+        pairs = []
+        for col in range(row, n, block_size):
+            block = row_block @ gallery[col:col + block_size].T
+            rows, cols = np.nonzero(block >= threshold)
+            for r, c in zip(rows.tolist(), cols.tolist()):
+                i, j = row + r, col + c
+                if i < j:
+                    pairs.append((i, j, float(block[r, c])))
+        yield min(row + block_size, n), pairs
+
+
+def scan_duplicates(ids: List[str],
+                    embeddings: np.ndarray,
+                    threshold: float,
+                    max_pairs: Optional[int] = None,
+                    block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[Dict]:
+    """
+    Find clusters of suspiciously similar gallery entries (same face
+    registered under several records, or look-alike impostors)
+
+    A cluster is emitted as soon as the scan has passed all of its members:
+    later block rows only pair entries from later rows, so they cannot
+    extend it. Only pairs of still-open clusters are kept in memory.
+
+    Yields:
+        {"type": "progress", "scanned": int, "total": int, "pairsFound": int}
+        {"type": "cluster", "members": [ids], "maxSimilarity": float,
+         "pairs": [{"a": id, "b": id, "similarity": float}]}
+        {"type": "error", "error": str}    # more than max_pairs matched; scan stops
+        {"type": "done", "clusters": int, "pairsFound": int, "total": int}
+    """
+    n = len(ids)
+    parent = list(range(n))
+
+    def find(x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def cluster_event(pairs: List[Tuple[int, int, float]]) -> Dict:
+        members = sorted({i for p in pairs for i in p[:2]})
+        return {
+            'type': 'cluster',
+            'members': [ids[i] for i in members],
+            'maxSimilarity': round(max(p[2] for p in pairs), 4),
+            'pairs': [
+                {'a': ids[i], 'b': ids[j], 'similarity': round(score, 4)}
+                for i, j, score in sorted(pairs, key=lambda p: -p[2])
+            ]
+        }
+
+    pending: List[Tuple[int, int, float]] = []
+    pairs_found = 0
+    emitted = 0
+
+    for scanned, pairs in iter_gallery_pairs(embeddings, threshold, block_size):
+        pairs_found += len(pairs)
+        if max_pairs is not None and pairs_found > max_pairs:
+            yield {'type': 'error',
+                   'error': f'More than {max_pairs} similar pairs at threshold {threshold} - raise the threshold'}
+            return
+
+        for i, j, _ in pairs:
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[root_j] = root_i
+        pending.extend(pairs)
+
+        clusters: Dict[int, List[Tuple[int, int, float]]] = {}
+        for pair in pending:
+            clusters.setdefault(find(pair[0]), []).append(pair)
+
+        # Every pair has i < j, so a cluster is closed once its largest member
+        # index has been scanned; most similar clusters first within a batch
+        closed = [c for c in clusters.values() if max(p[1] for p in c) < scanned]
+        closed.sort(key=lambda c: -max(p[2] for p in c))
+        for cluster in closed:
+            yield cluster_event(cluster)
+        emitted += len(closed)
+
+        pending = [pair for c in clusters.values() if max(p[1] for p in c) >= scanned for pair in c]
+        yield {'type': 'progress', 'scanned': scanned, 'total': n, 'pairsFound': pairs_found}
+
+    yield {'type': 'done', 'clusters': emitted, 'pairsFound': pairs_found, 'total': n}
@@ -0,0 +1,100 @@
+"""
+Cold-start benchmark
+
+Starts the service N times and measures, from process start:
+- listen: first successful GET /health
+- ready:  first GET /ready returning 200 (models loaded)
+
+Usage (from ai-ml/):
+    python scripts/bench_startup.py [--runs 3] [--cmd "python -m gunicorn ... wsgi:app"]
+
+The command may contain {port}; by default a single gthread Gunicorn worker
+with 4 threads is used, matching the Dockerfile.
+"""
+
+import argparse
+import os
+import shlex
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+AI_ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CMD = (f'{sys.executable} -m gunicorn --bind 127.0.0.1:{{port}} --workers 1 '
+               f'--worker-class gthread --threads 4 --timeout 120 wsgi:app')
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def get_status(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+        return 0
+
+
+def run_once(cmd: str, timeout: float) -> dict:
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        shlex.split(cmd.format(port=port)),
+        cwd=AI_ML_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+    listen = ready = None
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f'Service exited with code {process.returncode}')
+
+            if listen is None and get_status(base + '/health') == 200:
+                listen = round(time.perf_counter() - started, 3)
+            if listen is not None and get_status(base + '/ready') == 200:
+                ready = round(time.perf_counter() - started, 3)
+                break
+            time.sleep(0.05)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+    return {'listen': listen, 'ready': ready}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure service cold start')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--cmd', default=DEFAULT_CMD)
+    args = parser.parse_args()
+
+    results = []
+    for i in range(args.runs):
+        result = run_once(args.cmd, args.timeout)
+        results.append(result)
+        print(f"[Bench] Run {i + 1}: listen={result['listen']}s ready={result['ready']}s")
+
+    for key in ('listen', 'ready'):
+        values = [r[key] for r in results if r[key] is not None]
+        if values:
+            print(f"[Bench] {key:6s} median={statistics.median(values):.2f}s "
+                  f"min={min(values):.2f}s max={max(values):.2f}s ({len(values)}/{len(results)} runs)")
+        else:
+            print(f"[Bench] {key:6s} never reached within {args.timeout}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Bundle FaceNet model weights for offline use
+
+Downloads the InceptionResnetV1 (VGGFace2) weights once and saves them to
+MODEL_DIR, so the service can start with no network access
+(air-gapped school servers, Docker images, autoscaled instances).
+
+Usage (from ai-ml/):
+    python scripts/bundle_models.py [--model-dir ./models]
+
+Then run the service with MODEL_DIR=./models MODEL_OFFLINE=1
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.face_service import FaceRecognitionService  # noqa: E402
+
+
+def sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bundle FaceNet weights for offline startup')
+    parser.add_argument('--model-dir', default=FaceRecognitionService.MODEL_DIR,
+                        help='Output directory (default: $MODEL_DIR or ./models)')
+    args = parser.parse_args()
+
+    import torch
+    from facenet_pytorch import InceptionResnetV1
+
+    os.makedirs(args.model_dir, exist_ok=True)
+    weights_path = os.path.join(args.model_dir, FaceRecognitionService.FACENET_WEIGHTS)
+
+    print("[Bundle] Downloading InceptionResnetV1 (VGGFace2) weights...")
+    model = InceptionResnetV1(pretrained='vggface2').eval()
+    state_dict = {k: v for k, v in model.state_dict().items() if not k.startswith('logits.')}
+    torch.save(state_dict, weights_path)
+
+    manifest = {
+        'facenet': {
+            'file': FaceRecognitionService.FACENET_WEIGHTS,
+            'source': 'facenet_pytorch InceptionResnetV1(pretrained="vggface2")',
+            'sha256': sha256(weights_path),
+            'bytes': os.path.getsize(weights_path)
+        },
+        'mtcnn': 'bundled with the facenet_pytorch package',
+        'torch': torch.__version__,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    }
+    with open(os.path.join(args.model_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    # Verify the bundle loads the same way the service will load it
+    FaceRecognitionService.MODEL_DIR = args.model_dir
+    FaceRecognitionService.MODEL_OFFLINE = True
+    service = FaceRecognitionService(preload=True)
+
+    print(f"[Bundle] ✅ Saved {weights_path} ({manifest['facenet']['bytes'] / 1e6:.1f} MB), "
+          f"offline load took {service.load_seconds:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,655 @@
+"""
+Replayable load test
+
+Replays a seeded traffic trace - a morning spike of attendance photos per
+class, interleaved face registrations and health probes - through a local
+stand-in for the Node backend, and reports throughput, tail latency,
+error / timeout rates and per-worker CPU and RSS (read from /proc).
+
+Usage (from ai-ml/):
+    python scripts/loadtest.py generate --out trace.json [--seed 1 --classes 30 --class-size 40 ...]
+    python scripts/loadtest.py replay trace.json [--workers 4 --threads 4] [--report report.json]
+    python scripts/loadtest.py replay trace.json --url http://127.0.0.1:8000 --pid <server pid>
+
+replay starts the service with Gunicorn unless --url is given; the default
+command matches the Dockerfile (gthread worker class, --threads 4). The same trace always produces the same requests, so two runs
+(e.g. before / after a change to api/app.py) are directly comparable.
+
+Images are synthesized from the trace seed, which exercises decoding and
+detection only (no faces), so every attendance event comes back rejected;
+replay then marks the report invalid ("valid": false) and exits with
+status 1. Generate with --image-dir pointing at local face photos to
+exercise embedding and matching as well.
+"""
+
+import argparse
+import base64
+import json
+import math
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from bench_startup import AI_ML_DIR, free_port, get_status
+
+DEFAULT_CMD = (f'{sys.executable} -m gunicorn --bind 127.0.0.1:{{port}} --workers {{workers}} '
+               f'--worker-class gthread --threads {{threads}} --timeout 120 wsgi:app')
+
+TRACE_VERSION = 1
+EMBEDDING_DIM = 512
+
+# Timeouts used by the Node backend (attendanceController / aiController)
+BACKEND_ATTENDANCE_TIMEOUT = 60.0
+BACKEND_REGISTRATION_TIMEOUT = 30.0
+HEALTH_TIMEOUT = 5.0
+
+
+# ----------------------------------------------------------------------
+# Trace generation
+# ----------------------------------------------------------------------
+
+def generate_trace(args) -> Dict:
+    """Seeded trace: classes, image source and timed events"""
+    rng = random.Random(args.seed)
+
+    classes = [
+        {
+            'id': f'class-{i:03d}',
+            'school': f'school-{i % args.schools:02d}',
+            'size': max(1, round(args.class_size * rng.uniform(0.8, 1.2))),
+            'seed': rng.randrange(2 ** 31)
+        }
+        for i in range(args.classes)
+    ]
+
+    if args.image_dir:
+        files = sorted(
+            os.path.abspath(os.path.join(args.image_dir, name))
+            for name in os.listdir(args.image_dir)
+            if name.lower().endswith(('.jpg', '.jpeg', '.png'))
+        )
+        if not files:
+            raise SystemExit(f'No .jpg/.png images in {args.image_dir}')
+        images = {'files': files}
+        image_count = len(files)
+    else:
+        width, height = (int(v) for v in args.image_size.lower().split('x'))
+        images = {'synthetic': {'seed': rng.randrange(2 ** 31), 'width': width,
+                                'height': height, 'count': args.images}}
+        image_count = args.images
+
+    events = []
+    spike = args.duration * args.spike_at
+
+    # Each class takes 1..N photos (retakes a few seconds apart); most classes
+    # start inside the spike, the rest spread over the whole window
+    for cls in classes:
+        if rng.random() < args.baseline:
+            start = rng.uniform(0, args.duration)
+        else:
+            start = min(max(rng.gauss(spike, args.spike_width), 0.0), args.duration)
+        t = start
+        for _ in range(rng.randint(1, args.photos_per_class)):
+            events.append({'t': round(t, 3), 'type': 'attendance', 'class': cls['id'],
+                           'image': rng.randrange(image_count)})
+            t += rng.uniform(2, 8)
+
+    # Registrations arrive as a Poisson process
+    t, registered = 0.0, 0
+    while args.registration_rate > 0:
+        t += rng.expovariate(args.registration_rate)
+        if t >= args.duration:
+            break
+        cls = rng.choice(classes)
+        events.append({'t': round(t, 3), 'type': 'registration', 'class': cls['id'],
+                       'student': f"{cls['id']}-new{registered:03d}", 'image': rng.randrange(image_count)})
+        registered += 1
+
+    # Load-balancer style health probes
+    t = 0.0
+    while args.health_interval > 0 and t < args.duration:
+        events.append({'t': round(t, 3), 'type': 'health'})
+        t += args.health_interval
+
+    events.sort(key=lambda event: event['t'])
+
+    return {
+        'version': TRACE_VERSION,
+        'seed': args.seed,
+        'duration': args.duration,
+        'classes': classes,
+        'images': images,
+        'events': events
+    }
+
+
+def synth_image(seed: int, width: int, height: int) -> bytes:
+    """Camera-sized JPEG with gradients, shapes and sensor noise"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    base = rng.uniform(40, 200, size=3).astype(np.float32)
+    tilt = rng.uniform(-60, 60, size=3).astype(np.float32)
+    image = base + (x[None, :, None] * tilt + y[:, :, None] * tilt[::-1])
+
+    image = np.clip(image, 0, 255).astype(np.uint8)
+    for _ in range(25):
+        color = tuple(int(c) for c in rng.integers(0, 256, size=3))
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        if rng.random() < 0.5:
+            axes = (int(rng.integers(10, width // 6)), int(rng.integers(10, height // 6)))
+            cv2.ellipse(image, center, axes, float(rng.uniform(0, 180)), 0, 360, color, -1)
+        else:
+            corner = (center[0] + int(rng.integers(10, width // 5)), center[1] + int(rng.integers(10, height // 5)))
+            cv2.rectangle(image, center, corner, color, -1)
+
+    noise = rng.normal(0, 8, size=image.shape)
+    image = np.clip(image + noise, 0, 255).astype(np.uint8)
+
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    if not ok:
+        raise RuntimeError('JPEG encoding failed')
+    return encoded.tobytes()
+
+
+def load_images(spec: Dict) -> List[str]:
+    """Trace images as data URLs (what the frontend sends)"""
+    if 'files' in spec:
+        blobs = []
+        for path in spec['files']:
+            with open(path, 'rb') as f:
+                blobs.append(f.read())
+    else:
+        synthetic = spec['synthetic']
+        blobs = [
+            synth_image(synthetic['seed'] + i, synthetic['width'], synthetic['height'])
+            for i in range(synthetic['count'])
+        ]
+    return ['data:image/jpeg;base64,' + base64.b64encode(blob).decode() for blob in blobs]
+
+
+def class_students(cls: Dict) -> Dict[str, Dict]:
+    """Registered students of a class with seeded, L2-normalized encodings"""
+    rng = np.random.default_rng(cls['seed'])
+    encodings = rng.normal(size=(cls['size'], EMBEDDING_DIM))
+    encodings /= np.linalg.norm(encodings, axis=1, keepdims=True)
+    return {
+        f"{cls['id']}-s{j:02d}": {
+            'encoding': [round(float(v), 6) for v in encoding],
+            'name': f"Student {j + 1}",
+            'rollNumber': str(j + 1)
+        }
+        for j, encoding in enumerate(encodings)
+    }
+
+
+# ----------------------------------------------------------------------
+# Backend stand-in
+# ----------------------------------------------------------------------
+
+def post_json(url: str, payload: Dict, timeout: float) -> Tuple[int, Dict]:
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode(),
+        headers={'Content-Type': 'application/json'},
+        method='POST'
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b'{}')
+    except urllib.error.HTTPError as e:
+        try:
+            return e.code, json.loads(e.read() or b'{}')
+        except ValueError:
+            return e.code, {}
+
+
+def is_timeout(error: BaseException) -> bool:
+    reason = getattr(error, 'reason', error)
+    return isinstance(reason, (socket.timeout, TimeoutError)) or 'timed out' in str(reason)
+
+
+class BackendStandIn:
+    """
+    Minimal stand-in for the Node backend's recognition routes
+
+    - POST /api/attendance/recognize {classId, imageData}: looks up the class
+      gallery and calls the AI service with the backend's payload and 60 s timeout
+    - POST /api/ai/encode {image, classId, studentId}: calls /api/register-face
+      (30 s timeout) and stores the encoding, so later photos of that class
+      match against it
+    AI failures become 503 like the real backend; timedOut marks timeouts.
+    """
+
+    def __init__(self, ai_url: str, classes: List[Dict], attendance_path: str):
+        self.ai_url = ai_url.rstrip('/')
+        self.attendance_path = attendance_path
+        self.schools = {cls['id']: cls['school'] for cls in classes}
+        self.galleries = {cls['id']: class_students(cls) for cls in classes}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def recognize(self, data: Dict) -> Tuple[int, Dict]:
+        class_id = data.get('classId')
+        with self._lock:
+            students = dict(self.galleries.get(class_id, {}))
+        if not students:
+            return 400, {'success': False, 'message': 'No students with registered faces found in this class'}
+
+        try:
+            status, body = post_json(self.ai_url + self.attendance_path, {
+                'capturedImage': data.get('imageData'),
+                'students': students,
+                'schoolId': self.schools.get(class_id),
+                'classId': class_id
+            }, BACKEND_ATTENDANCE_TIMEOUT)
+        except OSError as e:
+            return 503, {'success': False, 'message': 'Face recognition service unavailable',
+                         'error': str(e), 'timedOut': is_timeout(e)}
+
+        if status >= 500:
+            return 503, {'success': False, 'message': 'Face recognition service unavailable',
+                         'error': f'AI service returned {status}', 'timedOut': False}
+
+        recognized = body.get('recognized') or []
+        return 200, {
+            'success': True,
+            'recognizedFace': bool(body.get('success')),
+            'data': {'recognized': len(recognized), 'total': len(students)}
+        }
+
+    def encode(self, data: Dict) -> Tuple[int, Dict]:
+        try:
+            status, body = post_json(self.ai_url + '/api/register-face', {'image': data.get('image')},
+                                     BACKEND_REGISTRATION_TIMEOUT)
+        except OSError as e:
+            return 503, {'success': False, 'message': 'Face encoding service unavailable',
+                         'timedOut': is_timeout(e)}
+
+        if status >= 500:
+            return 503, {'success': False, 'message': 'Face encoding service unavailable', 'timedOut': False}
+
+        if body.get('success') and body.get('encoding'):
+            with self._lock:
+                self.galleries.setdefault(data.get('classId'), {})[data.get('studentId')] = {
+                    'encoding': body['encoding'],
+                    'name': data.get('studentId'),
+                    'rollNumber': ''
+                }
+        return 200, {'success': bool(body.get('success')), 'error': body.get('error')}
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                try:
+                    data = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    data = {}
+
+                if self.path == '/api/attendance/recognize':
+                    status, body = stand_in.recognize(data)
+                elif self.path == '/api/ai/encode':
+                    status, body = stand_in.encode(data)
+                else:
+                    status, body = 404, {'success': False, 'message': 'Not found'}
+
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+# ----------------------------------------------------------------------
+# Process sampling (/proc)
+# ----------------------------------------------------------------------
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def read_proc(pid: int) -> Optional[Tuple[int, float, int]]:
+    """(parent pid, CPU seconds, RSS bytes) of a process, None if it is gone"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/statm') as f:
+            rss_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    # Fields after "(comm)": state ppid ... utime(12) stime(13)
+    cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    return int(fields[1]), cpu, rss_pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def child_pids(parent: int) -> List[int]:
+    children = []
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            info = read_proc(int(name))
+            if info and info[0] == parent:
+                children.append(int(name))
+    return children
+
+
+class ProcessSampler:
+    """Samples CPU and RSS of a server process and its workers in a background thread"""
+
+    def __init__(self, root_pid: int, interval: float = 0.5):
+        self.root_pid = root_pid
+        self.interval = interval
+        self.stats: Dict[int, Dict] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._sample()
+        self._thread.start()
+
+    def stop(self) -> List[Dict]:
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+        report = []
+        for pid, stat in sorted(self.stats.items()):
+            elapsed = stat['last_time'] - stat['first_time']
+            report.append({
+                'pid': pid,
+                'role': 'master' if pid == self.root_pid and len(self.stats) > 1 else 'worker',
+                'cpuAvgPercent': round((stat['last_cpu'] - stat['first_cpu']) / elapsed * 100, 1) if elapsed > 0 else 0.0,
+                'cpuMaxPercent': round(stat['max_cpu_percent'], 1),
+                'rssMaxMB': round(stat['max_rss'] / 1024 / 1024, 1),
+                'rssEndMB': round(stat['rss'] / 1024 / 1024, 1)
+            })
+        return report
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        now = time.perf_counter()
+        for pid in [self.root_pid] + child_pids(self.root_pid):
+            info = read_proc(pid)
+            if info is None:
+                continue
+            _, cpu, rss = info
+            stat = self.stats.get(pid)
+            if stat is None:
+                self.stats[pid] = {'first_time': now, 'first_cpu': cpu, 'last_time': now, 'last_cpu': cpu,
+                                   'max_cpu_percent': 0.0, 'rss': rss, 'max_rss': rss}
+                continue
+            if now > stat['last_time']:
+                percent = (cpu - stat['last_cpu']) / (now - stat['last_time']) * 100
+                stat['max_cpu_percent'] = max(stat['max_cpu_percent'], percent)
+            stat.update(last_time=now, last_cpu=cpu, rss=rss, max_rss=max(stat['max_rss'], rss))
+
+
+# ----------------------------------------------------------------------
+# Replay
+# ----------------------------------------------------------------------
+
+def fire(event: Dict, images: List[str], backend_url: str, ai_url: str) -> Dict:
+    """Send one trace event; returns its outcome and latency"""
+    kind = event['type']
+    started = time.perf_counter()
+    outcome = 'error'
+    status = 0
+
+    try:
+        if kind == 'health':
+            with urllib.request.urlopen(ai_url + '/health', timeout=HEALTH_TIMEOUT) as response:
+                status = response.status
+            outcome = 'ok'
+        elif kind == 'attendance':
+            status, body = post_json(backend_url + '/api/attendance/recognize', {
+                'classId': event['class'],
+                'imageData': images[event['image']]
+            }, BACKEND_ATTENDANCE_TIMEOUT + 5)
+            if status == 200:
+                # A photo without a recognizable face is a valid answer, not an error
+                outcome = 'ok' if body.get('recognizedFace') else 'rejected'
+            elif body.get('timedOut'):
+                outcome = 'timeout'
+        else:
+            status, body = post_json(backend_url + '/api/ai/encode', {
+                'image': images[event['image']],
+                'classId': event['class'],
+                'studentId': event['student']
+            }, BACKEND_REGISTRATION_TIMEOUT + 5)
+            if status == 200:
+                outcome = 'ok' if body.get('success') else 'rejected'
+            elif body.get('timedOut'):
+                outcome = 'timeout'
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError as e:
+        outcome = 'timeout' if is_timeout(e) else 'error'
+
+    return {'type': kind, 'status': status, 'outcome': outcome,
+            'latency': time.perf_counter() - started}
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(results: List[Dict], wall: float) -> Dict:
+    summary = {}
+    for kind in ['all'] + sorted({r['type'] for r in results}):
+        rows = [r for r in results if kind == 'all' or r['type'] == kind]
+        latencies = [r['latency'] * 1000 for r in rows]
+        counts = {outcome: sum(1 for r in rows if r['outcome'] == outcome)
+                  for outcome in ('ok', 'rejected', 'error', 'timeout')}
+        summary[kind] = {
+            'requests': len(rows),
+            **counts,
+            'throughputPerSec': round(len(rows) / wall, 2) if wall > 0 else 0.0,
+            'errorRate': round(counts['error'] / len(rows), 4) if rows else 0.0,
+            'timeoutRate': round(counts['timeout'] / len(rows), 4) if rows else 0.0,
+            'p50Ms': round(percentile(latencies, 50), 1),
+            'p95Ms': round(percentile(latencies, 95), 1),
+            'p99Ms': round(percentile(latencies, 99), 1),
+            'maxMs': round(max(latencies), 1) if latencies else 0.0
+        }
+    return summary
+
+
+def wait_ready(url: str, process: Optional[subprocess.Popen], timeout: float):
+    """Block until /ready returns 200 (models loaded)"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process is not None and process.poll() is not None:
+            raise SystemExit(f'Service exited with code {process.returncode}')
+        if get_status(url + '/ready') == 200:
+            return
+        time.sleep(0.2)
+    raise SystemExit(f'Service not ready within {timeout:.0f}s')
+
+
+def replay(args):
+    with open(args.trace) as f:
+        trace = json.load(f)
+    if trace.get('version') != TRACE_VERSION:
+        raise SystemExit(f"Unsupported trace version: {trace.get('version')}")
+
+    images = load_images(trace['images'])
+    events = trace['events']
+    print(f"[Load] Trace {args.trace}: {len(events)} events over {trace['duration']}s, "
+          f"{len(trace['classes'])} classes, {len(images)} images (seed {trace['seed']})")
+
+    process = None
+    if args.url:
+        ai_url = args.url.rstrip('/')
+        root_pid = args.pid
+    else:
+        port = free_port()
+        ai_url = f'http://127.0.0.1:{port}'
+        cmd = args.cmd.format(port=port, workers=args.workers, threads=args.threads)
+        # The child keeps its own copy of the descriptor
+        with open(args.server_log, 'ab') as log:
+            process = subprocess.Popen(shlex.split(cmd), cwd=AI_ML_DIR, stdout=log, stderr=subprocess.STDOUT)
+        root_pid = process.pid
+        print(f"[Load] Started service (pid {root_pid}): {cmd}")
+
+    backend = None
+    sampler = None
+    try:
+        wait_ready(ai_url, process, args.startup_timeout)
+        backend = BackendStandIn(ai_url, trace['classes'], args.attendance_path)
+
+        if root_pid:
+            sampler = ProcessSampler(root_pid)
+            sampler.start()
+
+        results = []
+        late = 0
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            futures = []
+            started = time.perf_counter()
+            for event in events:
+                delay = started + event['t'] / args.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -0.1:
+                    late += 1
+                futures.append(pool.submit(fire, event, images, backend.url, ai_url))
+            results = [future.result() for future in futures]
+            wall = time.perf_counter() - started
+    finally:
+        processes = sampler.stop() if sampler else []
+        if backend:
+            backend.close()
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    summary = summarize(results, wall)
+    print(f"[Load] Replayed in {wall:.1f}s (speed x{args.speed}, {late} events sent >100 ms late)")
+    for kind, row in summary.items():
+        print(f"[Load] {kind:12s} n={row['requests']:<5d} {row['throughputPerSec']:7.2f}/s  "
+              f"p50={row['p50Ms']:8.1f}ms p95={row['p95Ms']:8.1f}ms p99={row['p99Ms']:8.1f}ms  "
+              f"ok={row['ok']} rejected={row['rejected']} "
+              f"errors={row['errorRate']:.1%} timeouts={row['timeoutRate']:.1%}")
+    for proc in processes:
+        print(f"[Load] {proc['role']:6s} pid={proc['pid']:<7d} cpu avg={proc['cpuAvgPercent']:6.1f}% "
+              f"max={proc['cpuMaxPercent']:6.1f}%  rss max={proc['rssMaxMB']:7.1f}MB end={proc['rssEndMB']:7.1f}MB")
+    if not processes:
+        print("[Load] No per-worker stats (pass --pid with --url)")
+
+    warnings = []
+    attendance = summary.get('attendance')
+    # Attendance latency without embedding and matching says nothing about the service
+    valid = not (attendance and attendance['requests'] and attendance['rejected'] == attendance['requests'])
+    if not valid:
+        warnings.append('Every attendance event was rejected (no face found), so embedding and matching '
+                        'were not exercised - generate the trace with --image-dir pointing at face photos')
+    for warning in warnings:
+        print(f"[Load] Warning: {warning}")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({
+                'trace': os.path.abspath(args.trace),
+                'seed': trace['seed'],
+                'speed': args.speed,
+                'wallSeconds': round(wall, 3),
+                'lateEvents': late,
+                'valid': valid,
+                'summary': summary,
+                'processes': processes,
+                'warnings': warnings
+            }, f, indent=2)
+        print(f"[Load] Report written to {args.report}")
+
+    if not valid:
+        raise SystemExit('[Load] Report invalid: no attendance event reached embedding and matching')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replayable load test for the face recognition service')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    gen = commands.add_parser('generate', help='Write a seeded traffic trace')
+    gen.add_argument('--out', required=True)
+    gen.add_argument('--seed', type=int, default=1)
+    gen.add_argument('--duration', type=float, default=120.0, help='Trace length in seconds')
+    gen.add_argument('--schools', type=int, default=3)
+    gen.add_argument('--classes', type=int, default=30)
+    gen.add_argument('--class-size', type=int, default=40, help='Mean students per class (+/-20%%)')
+    gen.add_argument('--photos-per-class', type=int, default=2, help='Max attendance photos per class (retakes)')
+    gen.add_argument('--spike-at', type=float, default=0.3, help='Spike centre as a fraction of the duration')
+    gen.add_argument('--spike-width', type=float, default=10.0, help='Spike standard deviation in seconds')
+    gen.add_argument('--baseline', type=float, default=0.2, help='Fraction of classes outside the spike')
+    gen.add_argument('--registration-rate', type=float, default=0.2, help='Registrations per second')
+    gen.add_argument('--health-interval', type=float, default=5.0, help='Seconds between health probes')
+    gen.add_argument('--images', type=int, default=16, help='Synthetic images to generate')
+    gen.add_argument('--image-size', default='1280x720', help='Synthetic image size WxH')
+    gen.add_argument('--image-dir', help='Use local photos instead of synthetic images')
+
+    rep = commands.add_parser('replay', help='Replay a trace and report')
+    rep.add_argument('trace')
+    rep.add_argument('--url', help='Existing service URL (default: start one with --cmd)')
+    rep.add_argument('--pid', type=int, help='Server (master) pid to sample with --url')
+    rep.add_argument('--cmd', default=DEFAULT_CMD, help='May contain {port}, {workers} and {threads}')
+    rep.add_argument('--workers', type=int, default=1)
+    rep.add_argument('--threads', type=int, default=4, help='Gunicorn threads per worker (Dockerfile: 4)')
+    rep.add_argument('--server-log', default=os.devnull)
+    rep.add_argument('--startup-timeout', type=float, default=180.0)
+    rep.add_argument('--speed', type=float, default=1.0, help='Replay speed multiplier')
+    rep.add_argument('--concurrency', type=int, default=256, help='Max in-flight requests')
+    rep.add_argument('--attendance-path', default='/api/recognize-attendance',
+                     help='AI endpoint the backend stand-in calls (e.g. /api/route/recognize-attendance)')
+    rep.add_argument('--report', help='Write the summary as JSON')
+
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        trace = generate_trace(args)
+        with open(args.out, 'w') as f:
+            json.dump(trace, f)
+        counts = {}
+        for event in trace['events']:
+            counts[event['type']] = counts.get(event['type'], 0) + 1
+        print(f"[Load] Wrote {args.out}: {len(trace['events'])} events "
+              f"({', '.join(f'{k}={v}' for k, v in sorted(counts.items()))})")
+    else:
+        replay(args)
+
+
+if __name__ == '__main__':
+    main()